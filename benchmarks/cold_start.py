@@ -0,0 +1,86 @@
+"""
+Measure cold start latency of each handler: time to import ``stac_updater.handler`` and time of the first invocation,
+each in a fresh interpreter.  AWS services are replaced by the local stand-ins in ``standins.py``.
+
+    python benchmarks/cold_start.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HANDLERS = ['kickoff', 'update_collection', 'es_log_ingest']
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def child(handler_name):
+    """Run in a fresh interpreter: time the import and first invocation of a single handler"""
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from synthetic import logs_event, report_line, sample_collection, sample_item
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ.update({
+        'EVENT_SOURCE': 'lambda',
+        'COLLECTION_ROOT': sample_collection(tmpdir),
+        'ES_HOST': 'localhost',
+        'REGION': 'us-east-1',
+        # update_collection reads its (optional) sub-catalog template from PATH.
+        'PATH': '',
+    })
+
+    start = time.perf_counter()
+    from stac_updater import handler
+    imported = time.perf_counter()
+
+    import standins
+    standins.install(handler, s3=standins.LocalS3(tmpdir))
+    context = standins.Context()
+    invoke_start = time.perf_counter()
+    if handler_name == 'kickoff':
+        handler.kickoff(sample_item(), context)
+    elif handler_name == 'update_collection':
+        handler.update_collection({'Records': [{'messageId': '0', 'body': json.dumps(sample_item())}]}, context)
+    else:
+        # The logging module is imported by the handler, the stand-in must be in place before the first request.
+        from stac_updater import logging
+        logging._es = standins.LocalES(scripts={logging.ROLLUP_SCRIPT: logging.merge_rollup})
+        handler.es_log_ingest(logs_event([(
+            "LOGS CollectionName: landsat8\tItemCount: 1\tItemLinks: [\"https://stac.example.com/item0.json\"]\n",
+            report_line('abc', 442.49)
+        )]), context)
+    invoked = time.perf_counter()
+
+    return {'import': (imported - start) * 1000, 'first_invocation': (invoked - invoke_start) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help="Number of cold starts per handler.")
+    parser.add_argument('--child', choices=HANDLERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Handlers print their logs, keep stdout for the result.
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        result = child(args.child)
+        stdout.write(json.dumps(result))
+        return
+
+    print(f"{'handler':<20}{'import (ms)':>14}{'first invocation (ms)':>24}")
+    for handler_name in HANDLERS:
+        runs = []
+        for _ in range(args.repeat):
+            out = subprocess.check_output([sys.executable, __file__, '--child', handler_name])
+            runs.append(json.loads(out))
+        print(f"{handler_name:<20}{statistics.median(x['import'] for x in runs):>14.1f}"
+              f"{statistics.median(x['first_invocation'] for x in runs):>24.1f}")
+
+
+if __name__ == '__main__':
+    main()
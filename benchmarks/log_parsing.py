@@ -0,0 +1,92 @@
+"""
+Micro-benchmark of LOGS/REPORT parsing in ``es_log_ingest``: events/sec of the previous ``split``/``ast.literal_eval``
+parser against ``logging.transform_logs``, over synthetic CloudWatch payloads.
+
+    python benchmarks/log_parsing.py --events 20000 --links 10
+"""
+import argparse
+import ast
+import contextlib
+import copy
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from stac_updater import logging
+
+
+def legacy_transform_log(log):
+    """Parser used before LOGS lines carried JSON item links"""
+    log['id'] = int(str(log['id'])[:11])
+    message = log.pop('message')
+    splits = message.rstrip().split('\t')
+    log_type = splits[0].split(' ')[0]
+    splits[0] = splits[0].replace(log_type + ' ', '')
+
+    for item in splits:
+        k, v = item.split(': ')
+        if k == 'ItemLinks':
+            v = v.split('"')
+            if len(v) == 1:
+                v = v[0]
+            else:
+                v = '[' + ",".join(v) + ']'
+        else:
+            v = v.split(' ')[0]
+        k = k.replace(' ', '')
+        log.update({k: v})
+
+
+def legacy_transform_logs(first_log, second_log):
+    legacy_transform_log(first_log)
+    first_log['ItemLinks'] = ast.literal_eval(first_log['ItemLinks'])
+    legacy_transform_log(second_log)
+    return {**first_log, **second_log}
+
+
+def log_events(count, links, legacy=False):
+    """Synthetic (LOGS, REPORT) event pairs"""
+    events = []
+    for i in range(count // 2):
+        item_links = [f"https://stac.example.com/landsat8/{i}/{j}/item.json" for j in range(links)]
+        events.append((
+            {'id': f"{34819275800 + i}123456789", 'timestamp': 1561325126649 + i,
+             'message': f"LOGS CollectionName: landsat8\tItemCount: {links}\tCacheHits: 3\tCacheMisses: 1\t"
+                        f"ItemLinks: {item_links if legacy else json.dumps(item_links)}\n"},
+            {'id': f"{34819275800 + i}987654321", 'timestamp': 1561325126650 + i,
+             'message': f"REPORT RequestId: {i}\tDuration: 442.49 ms\tBilled Duration: 500 ms\tMemory Size: 1024 MB\t"
+                        f"Max Memory Used: 87 MB\t\n"}
+        ))
+    return events
+
+
+def run(transform, events):
+    """Events parsed per second"""
+    events = copy.deepcopy(events)
+    # transform_logs prints every document, which would dominate the timing.
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for first, second in events:
+            transform(first, second)
+        elapsed = time.perf_counter() - start
+    return 2 * len(events) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000, help="Number of log events.")
+    parser.add_argument('--links', type=int, default=10, help="Number of item links per LOGS event.")
+    args = parser.parse_args()
+
+    before = run(legacy_transform_logs, log_events(args.events, args.links, legacy=True))
+    after = run(logging.transform_logs, log_events(args.events, args.links))
+    print(f"before: {before:,.0f} events/sec")
+    print(f"after:  {after:,.0f} events/sec ({after / before:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
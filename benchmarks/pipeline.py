@@ -0,0 +1,246 @@
+"""
+Offline benchmark of the whole pipeline.  Synthetic STAC Items are uploaded to a local (filesystem-backed) bucket and
+driven in-process through kickoff -> SNS -> SQS -> update_collection (kickoff -> SQS with --direct), and the resulting
+LOGS/REPORT lines through es_log_ingest, with local stand-ins for S3, SNS, SQS and Elasticsearch.
+
+Reports items/sec, S3 GET/PUT requests per item and p50/p99 latency of each handler, and saves the results as JSON so
+runs of different versions can be compared.  The resulting collection is checked to link every item exactly once (the
+command fails otherwise).
+
+    python benchmarks/pipeline.py --items 1000 --batch-size 10 --depth 2 --fanout 10
+    python benchmarks/pipeline.py --compare benchmarks/results/<previous>.json
+    python benchmarks/pipeline.py --items 200 --depth 1 --fanout 4 --fifo --page-size 2
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..'))
+sys.path.insert(0, BENCHMARKS)
+
+import standins
+from synthetic import logs_event, path_template, report_line, sample_collection, sample_item
+
+LOGS_LINE = re.compile(r'^LOGS .*$', re.MULTILINE)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0
+
+
+def timed(func, *args):
+    """Call a handler with stdout captured, returning (elapsed ms, captured stdout)"""
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, out.getvalue()
+
+
+def check_links(filename):
+    """
+    Walk a collection (following child links and the pages of each catalog), returning (number of linked items,
+    links found more than once across the pages of a catalog)
+    """
+    links = []
+    page = filename
+    while page:
+        with open(page) as f:
+            page_links = json.load(f)['links']
+        links += [l for l in page_links if l['rel'] in ('item', 'child')]
+        following = [l['href'] for l in page_links if l['rel'] == 'next']
+        page = os.path.join(os.path.dirname(filename), following[0]) if following else None
+
+    hrefs = [l['href'] for l in links]
+    duplicates = [f"{filename}: {x}" for x in sorted(set(hrefs)) if hrefs.count(x) > 1]
+    items = len({l['href'] for l in links if l['rel'] == 'item'})
+    for href in sorted({l['href'] for l in links if l['rel'] == 'child'}):
+        child_items, child_duplicates = check_links(os.path.join(os.path.dirname(filename), href))
+        items += child_items
+        duplicates += child_duplicates
+    return items, duplicates
+
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=BENCHMARKS).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args):
+    tmpdir = tempfile.mkdtemp()
+    bucket = 'kickoff'
+    path = args.path if args.path is not None else path_template(args.depth)
+    queue_name = 'landsat8Queue.fifo' if args.fifo else 'landsat8Queue'
+    route = {'queue': queue_name, 'path': path} if args.fifo else {'queue': queue_name}
+
+    os.environ.update({
+        'EVENT_SOURCE': 's3',
+        'COLLECTION_ROOT': sample_collection(os.path.join(tmpdir, 'stac', 'landsat8')),
+        'FILENAME': args.filename or '',
+        'ES_HOST': 'localhost',
+        'REGION': 'us-east-1',
+        'ACCOUNT_ID': '123456789012',
+        'QUEUE_ROUTES': json.dumps({'landsat8': route}) if args.direct or args.fifo else '',
+        'FIFO_QUEUE': queue_name if args.fifo else '',
+        'CATALOG_PAGE_SIZE': str(args.page_size),
+    })
+    from stac_updater import handler, logging, storage
+
+    s3 = standins.LocalS3(tmpdir)
+    sns = standins.LocalSNS()
+    queue = standins.LocalQueue(queue_name)
+    sns.subscribe('newStacItemTopic', queue, {'collection': ['landsat8']})
+    standins.install(handler, s3=s3, sns=sns, sqs=standins.LocalSQS(queue))
+    logging._es = es = standins.LocalES(scripts={logging.ROLLUP_SCRIPT: logging.merge_rollup})
+    context = standins.Context()
+
+    for i in range(args.items):
+        s3.put_object(Bucket=bucket, Key=f"items/item{i}.json",
+                      Body=json.dumps(sample_item(i, depth=args.depth, fanout=args.fanout)))
+    s3.puts = 0
+
+    latencies = {'kickoff': [], 'update_collection': [], 'es_log_ingest': []}
+    s3_requests = {'kickoff': {'gets': 0, 'puts': 0}, 'update_collection': {'gets': 0, 'puts': 0}}
+    start = time.perf_counter()
+
+    # kickoff: one S3 event per object, S3 may batch several records into a single event.
+    for i in range(0, args.items, args.s3_batch_size):
+        records = [{'s3': {'bucket': {'name': bucket}, 'object': {'key': f"items/item{j}.json"}}}
+                   for j in range(i, min(i + args.s3_batch_size, args.items))]
+        elapsed, _ = timed(handler.kickoff, {'Records': records}, context)
+        latencies['kickoff'].append(elapsed)
+    s3_requests['kickoff'] = {'gets': s3.gets, 'puts': s3.puts}
+
+    # update_collection: drain the collection's queue in SQS batches.  The PATH environment variable holds the
+    # sub-catalog template, so it is only swapped in while the handler runs.
+    logs = []
+    system_path = os.environ['PATH']
+    try:
+        os.environ['PATH'] = path
+        while True:
+            event = queue.receive(args.batch_size)
+            if event is None:
+                break
+            if args.cold:
+                storage._cache.clear()
+            elapsed, out = timed(handler.update_collection, event, context)
+            latencies['update_collection'].append(elapsed)
+            s3_requests['update_collection']['gets'] += storage.STATS['gets']
+            s3_requests['update_collection']['puts'] += storage.STATS['puts']
+            logs.append((LOGS_LINE.search(out).group(0) + '\n', report_line(len(logs), elapsed)))
+    finally:
+        os.environ['PATH'] = system_path
+
+    # es_log_ingest: CloudWatch delivers the LOGS/REPORT lines of several invocations per event.
+    for i in range(0, len(logs), args.log_batch_size):
+        event = logs_event(logs[i:i + args.log_batch_size], start_id=34819275800 + i)
+        elapsed, _ = timed(handler.es_log_ingest, event, context)
+        latencies['es_log_ingest'].append(elapsed)
+
+    total = time.perf_counter() - start
+    indexed = sum(len(x) for name, x in es.docs.items() if name != logging.ROLLUP_INDEX)
+    linked, duplicates = check_links(os.environ['COLLECTION_ROOT'])
+
+    return {
+        'version': args.label or version(),
+        'parameters': {
+            'items': args.items,
+            'batch_size': args.batch_size,
+            's3_batch_size': args.s3_batch_size,
+            'depth': args.depth,
+            'fanout': args.fanout,
+            'path': path,
+            'filename': args.filename,
+            'cold': args.cold,
+            'direct': args.direct,
+            'fifo': args.fifo,
+            'page_size': args.page_size,
+        },
+        'items_per_second': args.items / total,
+        'indexed_logs': indexed,
+        'linked_items': linked,
+        'duplicate_links': duplicates,
+        'handlers': {
+            name: {
+                'invocations': len(values),
+                'p50_ms': percentile(values, 50),
+                'p99_ms': percentile(values, 99),
+                **({
+                    's3_gets_per_item': s3_requests[name]['gets'] / args.items,
+                    's3_puts_per_item': s3_requests[name]['puts'] / args.items,
+                } if name in s3_requests else {})
+            } for name, values in latencies.items()
+        }
+    }
+
+
+def report(results, previous=None):
+    print(f"version {results['version']}: {results['items_per_second']:,.1f} items/sec"
+          + (f" (previous {previous['version']}: {previous['items_per_second']:,.1f})" if previous else ''))
+    columns = ['invocations', 'p50_ms', 'p99_ms', 's3_gets_per_item', 's3_puts_per_item']
+    print(f"{'handler':<20}" + ''.join(f"{x:>18}" for x in columns))
+    for name, stats in results['handlers'].items():
+        row = f"{name:<20}"
+        for column in columns:
+            value = stats.get(column)
+            if value is None:
+                row += f"{'-':>18}"
+                continue
+            cell = f"{value:,.2f}"
+            if previous and previous['handlers'].get(name, {}).get(column):
+                cell += f" ({(value / previous['handlers'][name][column] - 1) * 100:+.0f}%)"
+            row += f"{cell:>18}"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000, help="Number of synthetic STAC Items.")
+    parser.add_argument('--batch-size', type=int, default=10, help="SQS batch size of update_collection.")
+    parser.add_argument('--s3-batch-size', type=int, default=1, help="Records per kickoff S3 event.")
+    parser.add_argument('--log-batch-size', type=int, default=50, help="Invocations per CloudWatch logs event.")
+    parser.add_argument('--depth', type=int, default=2, help="Number of sub-catalog levels.")
+    parser.add_argument('--fanout', type=int, default=10, help="Sub-catalogs per level.")
+    parser.add_argument('--path', type=str, help="--path template (defaults to one level per --depth).")
+    parser.add_argument('--filename', type=str, help="--filename template.")
+    parser.add_argument('--cold', action='store_true', help="Clear the catalog cache before every invocation.")
+    parser.add_argument('--direct', action='store_true', help="Route items from kickoff straight to the queue.")
+    parser.add_argument('--fifo', action='store_true', help="Update the collection through a FIFO queue.")
+    parser.add_argument('--page-size', type=int, default=0, help="Item/child links per catalog page (0 disables).")
+    parser.add_argument('--label', type=str, help="Name of the results (defaults to `git describe`).")
+    parser.add_argument('--output', type=str, help="Results file (defaults to benchmarks/results/<label>.json).")
+    parser.add_argument('--compare', type=str, help="Results file of a previous run to compare against.")
+    args = parser.parse_args()
+
+    results = run(args)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    report(results, previous)
+
+    output = args.output or os.path.join(BENCHMARKS, 'results', f"{results['version']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f"Saved results to {output}")
+
+    if results['linked_items'] != args.items or results['duplicate_links']:
+        sys.exit(f"Collection links {results['linked_items']} of {args.items} items, duplicate links: "
+                 f"{results['duplicate_links']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Local stand-ins for the AWS services used by the handlers, so the handlers can be run (and timed) in-process."""
+import fnmatch
+import io
+import json
+import os
+import uuid
+
+
+class Context(object):
+    """Lambda context object"""
+
+    def __init__(self, function_name='stac-updater-dev-kickoff', remaining=900000):
+        self.function_name = function_name
+        self.invoked_function_arn = f"arn:aws:lambda:us-east-1:123456789012:function:{function_name}"
+        self.aws_request_id = str(uuid.uuid4())
+        self.remaining = remaining
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining
+
+
+class LocalS3(object):
+    """S3 client backed by a local directory (one sub-directory per bucket)"""
+
+    def __init__(self, root):
+        self.root = root
+        self.gets = 0
+        self.puts = 0
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.gets += 1
+        with open(self.path(Bucket, Key), 'rb') as f:
+            if Range:
+                f.seek(int(Range.split('=')[1].split('-')[0]))
+            return {'Body': io.BytesIO(f.read())}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.puts += 1
+        fname = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, 'wb') as f:
+            f.write(Body.encode('utf-8') if isinstance(Body, str) else Body)
+        return {}
+
+
+class LocalQueue(object):
+    """SQS queue which hands out messages in SQS lambda-trigger batches"""
+
+    def __init__(self, name):
+        self.name = name
+        self.messages = []
+
+    def send(self, body, group_id=None):
+        message = {'messageId': str(uuid.uuid4()), 'body': body}
+        if group_id:
+            message['attributes'] = {'MessageGroupId': group_id}
+        self.messages.append(message)
+
+    def receive(self, batch_size=10):
+        """SQS event of the next ``batch_size`` messages (None once the queue is empty)"""
+        batch, self.messages = self.messages[:batch_size], self.messages[batch_size:]
+        return {'Records': batch} if batch else None
+
+
+class LocalSNS(object):
+    """SNS client which keeps every published message and fans messages out to subscribed queues"""
+
+    def __init__(self):
+        self.messages = []
+        self.requests = 0
+        self.subscriptions = []
+
+    def subscribe(self, topic_name, queue, filter_policy=None):
+        """Subscribe a queue to a topic with raw message delivery (see ``resources.subscribe_sqs_to_sns``)"""
+        self.subscriptions.append((topic_name, queue, filter_policy or {}))
+
+    def _deliver(self, message):
+        self.messages.append(message)
+        for topic_name, queue, filter_policy in self.subscriptions:
+            if not message['TopicArn'].endswith(':' + topic_name):
+                continue
+            attributes = message['MessageAttributes']
+            if all(k in attributes and attributes[k]['StringValue'] in v for k, v in filter_policy.items()):
+                queue.send(message['Message'])
+
+    def publish(self, TopicArn, Message, MessageAttributes=None, **kwargs):
+        self.requests += 1
+        self._deliver({'TopicArn': TopicArn, 'Message': Message, 'MessageAttributes': MessageAttributes or {}})
+        return {'MessageId': str(uuid.uuid4())}
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        self.requests += 1
+        for entry in PublishBatchRequestEntries:
+            self._deliver({
+                'TopicArn': TopicArn,
+                'Message': entry['Message'],
+                'MessageAttributes': entry.get('MessageAttributes', {})
+            })
+        return {'Successful': [{'Id': x['Id']} for x in PublishBatchRequestEntries], 'Failed': []}
+
+
+class LocalSQS(object):
+    """SQS client which delivers to local queues, keyed by queue name (the last part of the queue URL)"""
+
+    def __init__(self, *queues):
+        self.queues = {queue.name: queue for queue in queues}
+        self.requests = 0
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.requests += 1
+        queue = self.queues[QueueUrl.rsplit('/', 1)[1]]
+        for entry in Entries:
+            queue.send(entry['MessageBody'], entry.get('MessageGroupId'))
+        return {'Successful': [{'Id': x['Id']} for x in Entries], 'Failed': []}
+
+
+class LocalLambda(object):
+    """Lambda client which keeps every asynchronous invocation"""
+
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, FunctionName, Payload, InvocationType='RequestResponse'):
+        self.invocations.append({'FunctionName': FunctionName, 'Payload': json.loads(Payload)})
+        return {'StatusCode': 202}
+
+
+class _LocalIndices(object):
+
+    def __init__(self, es):
+        self.es = es
+
+    def exists(self, index):
+        self.es.requests += 1
+        return index in self.es.docs
+
+    def create(self, index, body=None):
+        self.es.requests += 1
+        self.es.docs.setdefault(index, {})
+
+    def put_template(self, name, body):
+        self.es.requests += 1
+        self.es.templates[name] = body
+
+
+class LocalES(object):
+    """
+    Elasticsearch client backed by a dictionary of {index: {id: document}}.  Stored scripts are run by the python
+    function registered for their ID in ``scripts``, called with (document, params).
+    """
+
+    def __init__(self, scripts=None):
+        self.docs = {}
+        self.templates = {}
+        self.stored_scripts = {}
+        self.scripts = scripts or {}
+        self.requests = 0
+        self.indices = _LocalIndices(self)
+
+    def put_script(self, id, body):
+        self.requests += 1
+        self.stored_scripts[id] = body
+
+    def bulk(self, body):
+        """Supports the update actions (doc_as_upsert, or a stored script with an upsert) of ``logging.bulk_index``"""
+        self.requests += 1
+        items = []
+        for action, source in zip(body[::2], body[1::2]):
+            meta = action['update']
+            doc = self.docs.setdefault(meta['_index'], {}).setdefault(str(meta['_id']), {})
+            result = 'updated' if doc else 'created'
+            if 'script' in source:
+                if doc:
+                    self.scripts[source['script']['id']](doc, source['script']['params'])
+                else:
+                    doc.update(json.loads(json.dumps(source['upsert'])))
+            else:
+                doc.update(source['doc'])
+            item = {'_index': meta['_index'], '_id': meta['_id'], 'result': result}
+            if source.get('_source'):
+                item['get'] = {'_source': dict(doc)}
+            items.append({'update': item})
+        return {'errors': False, 'items': items}
+
+    def search(self, index, body):
+        """Supports the timestamp range, sort and size of ``tuning.search_logs``"""
+        self.requests += 1
+        since = body['query']['range']['timestamp']['gte']
+        docs = [doc for name, docs in self.docs.items() if fnmatch.fnmatch(name, index)
+                for doc in docs.values() if doc.get('timestamp', 0) >= since]
+        docs.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
+        return {'hits': {'hits': [{'_source': doc} for doc in docs[:body['size']]]}}
+
+
+def install(handler, s3=None, sns=None, lambda_=None, sqs=None):
+    """Replace the boto3 clients used by the handlers with stand-ins"""
+    handler._clients.update({
+        's3': s3 or LocalS3(os.getcwd()),
+        'sns': sns or LocalSNS(),
+        'sqs': sqs or LocalSQS(),
+        'lambda': lambda_ or LocalLambda(),
+    })
+    return handler._clients
@@ -0,0 +1,74 @@
+"""Synthetic STAC Items, collections and CloudWatch log payloads for the benchmarks."""
+import base64
+import gzip
+import json
+import os
+import random
+
+
+def sample_item(i=0, depth=0, fanout=10, collection='landsat8'):
+    """
+    STAC Item whose ``level0`` ... ``level{depth-1}`` properties take ``fanout`` distinct values, so a ``--path`` of
+    ``path_template(depth)`` spreads items across ``fanout ** depth`` sub-catalogs.
+    """
+    rng = random.Random(i)
+    xmin, ymin = rng.uniform(-180, 179), rng.uniform(-90, 89)
+    properties = {'collection': collection, 'datetime': '2019-06-23T21:25:26Z'}
+    properties.update({f"level{d}": str(rng.randrange(fanout)) for d in range(depth)})
+    return {
+        "type": "Feature",
+        "id": f"item{i}",
+        "bbox": [xmin, ymin, xmin + 1, ymin + 1],
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[xmin, ymin], [xmin + 1, ymin], [xmin + 1, ymin + 1], [xmin, ymin + 1], [xmin, ymin]]]
+        },
+        "properties": properties,
+        "assets": {
+            "thumbnail": {"href": f"https://example.com/{i}/thumb.jpg", "type": "image/jpeg"}
+        },
+        "links": []
+    }
+
+
+def path_template(depth):
+    """``--path`` template (as passed to ``stac-updater update-collection``) matching ``sample_item(depth=depth)``"""
+    return '/'.join('{level%d}' % d for d in range(depth))
+
+
+def sample_collection(directory, collection='landsat8'):
+    """Write an empty collection to ``directory`` and return the filename of its root catalog"""
+    os.makedirs(directory, exist_ok=True)
+    fname = os.path.join(directory, 'catalog.json')
+    with open(fname, 'w') as f:
+        json.dump({
+            "id": collection,
+            "stac_version": "0.6.0",
+            "description": "Synthetic collection",
+            "license": "PDDL-1.0",
+            "extent": {},
+            "links": [
+                {"rel": "self", "href": f"https://stac.example.com/{collection}/catalog.json"},
+                {"rel": "root", "href": "./catalog.json"}
+            ]
+        }, f)
+    return fname
+
+
+def report_line(request_id, duration, memory_size=1024, memory_used=87):
+    """REPORT line written by lambda at the end of every invocation"""
+    return (f"REPORT RequestId: {request_id}\tDuration: {duration:.2f} ms\tBilled Duration: "
+            f"{int(-(-duration // 100) * 100)} ms\tMemory Size: {memory_size} MB\tMax Memory Used: {memory_used} MB\t\n")
+
+
+def logs_event(messages, start_id=34819275800, timestamp=1561325126649):
+    """
+    CloudWatch subscription event carrying (LOGS, REPORT) message pairs, one pair per invocation.  Events of the same
+    invocation share the first 11 characters of their ID.
+    """
+    events = []
+    for i, pair in enumerate(messages):
+        for j, message in enumerate(pair):
+            events.append({'id': f"{start_id + i}{j:09d}", 'timestamp': timestamp + i, 'message': message})
+    payload = gzip.compress(json.dumps({'logEvents': events}).encode('utf-8'))
+    return {'awslogs': {'data': base64.b64encode(payload).decode('utf-8')}}
@@ -0,0 +1,181 @@
+"""
+Ingest an archive of STAC Items straight into a collection, without going through kickoff, SNS and SQS.  Items are
+parsed, rendered and written by a pool of worker processes while the catalogs are built in memory by the main process
+and written in a single pass at the end.  Progress is checkpointed after every chunk, so an interrupted backfill
+resumes where it stopped.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import json
+import os
+
+from satstac import Item
+
+from stac_updater import catalog, storage, stream
+from stac_updater.utils import sat_stac_pattern
+
+# Set in each worker process by ``_init_worker``.
+_worker = {}
+
+
+def _s3_client():
+    import boto3
+    return boto3.client('s3')
+
+
+def _split_s3(url):
+    bucket, _, key = url[5:].partition('/')
+    return bucket, key
+
+
+def _open_file(url):
+    """Stream of the decompressed bytes of a local or S3 file"""
+    if url.startswith('s3://'):
+        bucket, key = _split_s3(url)
+        body = _s3_client().get_object(Bucket=bucket, Key=key)['Body']
+    else:
+        body = open(url, 'rb')
+    return stream.open_stream(body, url)
+
+
+def _lines(body):
+    # S3 streaming bodies iterate over fixed-size chunks, not lines.
+    return body.iter_lines() if hasattr(body, 'iter_lines') else body
+
+
+def read_chunks(source, chunk_size):
+    """
+    Split the input into chunks of at most ``chunk_size`` work units, each given as ('file', [urls]) or
+    ('ndjson', [lines]).  The source is a local directory of STAC Item files, a S3 prefix (`s3://bucket/prefix/`) or a
+    local or S3 NDJSON file (optionally gzipped).  Chunks are always produced in the same order.
+    """
+    if stream.detect_format(source) == stream.NDJSON:
+        kind = 'ndjson'
+        units = (line.decode('utf-8') for line in _lines(_open_file(source)) if line.strip())
+    elif source.startswith('s3://'):
+        kind = 'file'
+        bucket, prefix = _split_s3(source)
+        pages = _s3_client().get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix)
+        units = (f"s3://{bucket}/{x['Key']}" for page in pages for x in page.get('Contents', [])
+                 if x['Key'].endswith('.json'))
+    elif os.path.isdir(source):
+        kind = 'file'
+        units = iter(sorted(glob.glob(os.path.join(source, '**', '*.json'), recursive=True)))
+    else:
+        raise ValueError(f"Unsupported source {source}, expected a directory, S3 prefix or NDJSON file.")
+
+    chunk = []
+    for unit in units:
+        chunk.append(unit)
+        if len(chunk) == chunk_size:
+            yield kind, chunk
+            chunk = []
+    if chunk:
+        yield kind, chunk
+
+
+def _init_worker(root, path, filename):
+    _worker['root'] = root
+    _worker['kwargs'] = {k: sat_stac_pattern(v) for k, v in (('path', path), ('filename', filename)) if v}
+
+
+def _parse(kind, unit):
+    if kind == 'ndjson':
+        return json.loads(unit)
+    f = _open_file(unit)
+    try:
+        return json.loads(f.read())
+    finally:
+        f.close()
+
+
+def render_chunk(kind, units):
+    """
+    Parse, render and write the STAC Items of a chunk (in a worker process).  Returns (item filename, sub-catalog path)
+    of the saved items, so the main process can link them, and the number of items which failed.
+    """
+    # A new batch per chunk, so the in-memory catalogs of the worker don't grow with every item it renders.
+    batch = catalog.CollectionBatch(catalog.open_collection(_worker['root']))
+    items = {}
+    failures = 0
+    for unit in units:
+        try:
+            item = Item(_parse(kind, unit))
+            # Rendered only: the sub-catalogs are created and linked by the main process.
+            subpath = batch.render_item(item, **_worker['kwargs'])
+            items[item.filename] = subpath
+        except Exception as e:
+            print(f"Failed to add {unit[:200]}: {type(e).__name__}: {e}")
+            failures += 1
+
+    # Only the items are saved here, the main process builds and saves the catalogs.
+    errors = storage.write_many([(fname, item.data) for fname, item in batch.items.items()], cache=False)
+    return [(fname, path) for fname, path in items.items() if fname not in errors], failures + len(errors)
+
+
+def read_checkpoint(checkpoint, source, root):
+    """Results of the chunks completed by a previous run, as {chunk number: [(item filename, sub-catalog path)]}"""
+    done = {}
+    if not os.path.exists(checkpoint):
+        return done
+    with open(checkpoint) as f:
+        header = json.loads(f.readline())
+        if header != {'source': source, 'root': root}:
+            raise ValueError(f"{checkpoint} is the checkpoint of another backfill ({header}).")
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Last line of an interrupted run.
+                break
+            done[entry['chunk']] = entry['items']
+    return done
+
+
+def backfill(root, source, path=None, filename=None, workers=None, chunk_size=500, checkpoint='backfill.checkpoint'):
+    """
+    Ingest every STAC Item of ``source`` (see ``read_chunks``) into the collection at ``root``, rendering
+    ``path``/``filename`` like update_collection.  Returns (number of items linked, number of items which failed).
+    """
+    workers = workers or os.cpu_count()
+    done = read_checkpoint(checkpoint, source, root)
+    if not done:
+        with open(checkpoint, 'w') as f:
+            f.write(json.dumps({'source': source, 'root': root}) + '\n')
+
+    batch = catalog.CollectionBatch(catalog.open_collection(root))
+    failures = 0
+
+    def link(number, future):
+        nonlocal failures
+        if future is None:
+            items = done[number]
+        else:
+            items, failed = future.result()
+            failures += failed
+            # Chunks with failed items are processed again when the backfill is resumed.
+            if not failed:
+                log.write(json.dumps({'chunk': number, 'items': items}) + '\n')
+                log.flush()
+        for item_fname, item_path in items:
+            batch.link_item(item_fname, item_path)
+        print(f"Chunk {number}: {len(items)} items")
+
+    with open(checkpoint, 'a') as log, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(root, path, filename)) as executor:
+        # Chunks are linked in order, with a bounded number of chunks in flight.
+        pending = deque()
+        for number, (kind, units) in enumerate(read_chunks(source, chunk_size)):
+            pending.append((number, None if number in done else executor.submit(render_chunk, kind, units)))
+            while len(pending) > 2 * workers:
+                link(*pending.popleft())
+        while pending:
+            link(*pending.popleft())
+
+    linked = len(batch.ancestors)
+    failed_items = batch.save()
+    if failed_items:
+        raise IOError(f"Failed to save the catalogs of {len(failed_items)} items, run the backfill again to retry.")
+    return linked, failures
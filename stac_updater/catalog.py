@@ -0,0 +1,418 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+from satstac import Catalog, Collection, STACError
+
+from stac_updater import storage
+
+# Catalogs with more item links than this are split into pages (`catalog-2.json`, ... chained with `next` links, the
+# head `catalog.json` links to the `last` page), so adding an item only rewrites the last page.  Child links always stay
+# on the head, so a sub-catalog can be found without reading every page.  0 disables paging.
+PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', 0))
+PAGE = re.compile(r'catalog-(\d+)\.json$')
+
+
+def open_catalog(filename, cls=Catalog):
+    """Open a catalog (or collection) through the warm-container catalog cache"""
+    return cls(storage.read_json(filename), filename=filename)
+
+
+def open_collection(filename):
+    """Open a collection through the warm-container catalog cache"""
+    return open_catalog(filename, cls=Collection)
+
+
+def depth(filename):
+    """Number of path segments in a catalog/item filename (used to order saves)"""
+    return filename.rstrip('/').count('/')
+
+
+def link_href(cat, rel):
+    """Relative href of a catalog's link (``Catalog.links`` resolves hrefs against the local filesystem or HTTP)"""
+    links = [l['href'] for l in cat.data['links'] if l['rel'] == rel]
+    return links[-1] if links else None
+
+
+def page_links(cat):
+    """Links which are split across the pages of a catalog"""
+    return [l for l in cat.data['links'] if l['rel'] == 'item']
+
+
+def page_name(number):
+    return 'catalog.json' if number == 1 else 'catalog-%d.json' % number
+
+
+def new_page(head, number):
+    """Empty page ``number`` (from 2) of a paged catalog, linked to the previous page"""
+    links = [{'rel': 'self', 'href': os.path.join(os.path.dirname(l['href']), page_name(number))}
+             for l in head.data['links'] if l['rel'] == 'self']
+    links += [dict(l) for l in head.data['links'] if l['rel'] in ('root', 'parent')]
+    links.append({'rel': 'prev', 'href': page_name(number - 1)})
+    data = {
+        'id': '%s-%d' % (head.id, number),
+        'stac_version': head.data.get('stac_version'),
+        'description': 'Page %d of %s catalog' % (number, head.id),
+        'links': links
+    }
+    return Catalog(data, filename=os.path.join(head.path, page_name(number)))
+
+
+def paginate(filename, page_size):
+    """
+    Split a catalog, and recursively its sub-catalogs, into pages of at most ``page_size`` item links (see
+    ``PAGE_SIZE``).  Catalogs which are already paged are re-split with the new page size, and child links found on
+    their pages are moved to the head.  Returns the filenames of the catalogs which were rewritten.
+    """
+    head = open_catalog(filename)
+    pages = [head]
+    while link_href(pages[-1], 'next'):
+        pages.append(open_catalog(os.path.join(head.path, link_href(pages[-1], 'next'))))
+    links = [l for page in pages for l in page_links(page)]
+    children = [l for page in pages for l in page.data['links'] if l['rel'] == 'child']
+
+    written = []
+    if len(pages) > 1 or len(links) > page_size:
+        chunks = [links[i:i + page_size] for i in range(0, len(links), page_size)] or [[]]
+        head.data['links'] = [l for l in head.data['links'] if l['rel'] not in ('item', 'child', 'next', 'last')]
+        head.data['links'] += children
+        pages = [head] + [new_page(head, number) for number in range(2, len(chunks) + 1)]
+        for number, (page, chunk) in enumerate(zip(pages, chunks), 1):
+            page.data['links'] += chunk
+            if number < len(pages):
+                page.data['links'].append({'rel': 'next', 'href': page_name(number + 1)})
+        if len(pages) > 1:
+            head.data['links'].append({'rel': 'last', 'href': page_name(len(pages))})
+
+        # Pages are written before the head, which links to them.
+        errors = storage.write_many([(page.filename, page.data) for page in pages[1:]])
+        if errors:
+            raise IOError(f"Failed to write {len(errors)} pages of {filename}")
+        storage.write_json(filename, head.data)
+        written += [page.filename for page in pages]
+
+    for link in children:
+        written += paginate(os.path.join(head.path, link['href']), page_size)
+    return written
+
+
+class CollectionBatch(object):
+    """
+    Add many items to a collection while deferring all writes until ``save``.  Mirrors ``Collection.add_item`` from
+    sat-stac but every catalog which is read or created is kept in memory, so a batch of N items opens each catalog
+    once and saves each touched catalog once instead of N times.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.root_link = collection.links('root')[0]
+        self.root_path = os.path.dirname(self.root_link)
+        self.endpoint = self._endpoint()
+
+        # Catalogs opened (or created) during the batch, keyed by filename.
+        self.catalogs = {collection.filename: collection}
+        # Catalogs and items which must be saved, keyed by filename.
+        self.dirty = {}
+        self.items = {}
+        # Links added to each catalog during the batch as (rel, href, target filename), and the catalogs leading to
+        # each item, so items whose writes fail can be unlinked and reported.
+        self.new_links = {}
+        self.ancestors = {}
+        # Pages started during the batch, saved before the catalogs which link to them.
+        self.new_pages = set()
+        self.hrefs = {}
+
+    def _endpoint(self):
+        """Endpoint URL of the root catalog (only opens the root if it isn't the collection itself)"""
+        if os.path.normpath(self.root_link) == os.path.normpath(self.collection.filename):
+            root = self.collection
+        else:
+            root = open_catalog(self.root_link)
+        return os.path.dirname(root.links('self')[0])
+
+    def _touch(self, cat):
+        self.dirty[cat.filename] = cat
+
+    def _open(self, fname):
+        """Open a catalog once per batch"""
+        if fname not in self.catalogs:
+            self.catalogs[fname] = open_catalog(fname)
+        return self.catalogs[fname]
+
+    def _tail(self, cat):
+        """Last page of a catalog (see ``PAGE_SIZE``), starting a new page if it is full"""
+        last = link_href(cat, 'last')
+        tail = self._open(os.path.join(cat.path, last)) if last else cat
+        if not PAGE_SIZE or len(page_links(tail)) < PAGE_SIZE:
+            return tail
+
+        number = int(PAGE.search(tail.filename).group(1)) + 1 if last else 2
+        page = new_page(cat, number)
+        self.catalogs[page.filename] = page
+        self.new_pages.add(page.filename)
+        self._touch(page)
+        # The previous `last` link is only dropped once the new page is saved (see ``save``).
+        self._add_link(tail, 'next', page_name(number), page.filename, paged=False)
+        self._add_link(cat, 'last', page_name(number), page.filename, paged=False)
+        return page
+
+    def _add_link(self, cat, rel, href, target, paged=True):
+        """
+        Add a link to a catalog (to its last page for item links), remembering it if the catalog (page) didn't already
+        have it.  Returns the catalog (page) the link was added to.
+        """
+        if paged and rel == 'item':
+            cat = self._tail(cat)
+        # Links of each catalog are indexed on first use so adding many links to a catalog isn't quadratic.
+        links = self.hrefs.get(cat.filename)
+        if links is None:
+            links = self.hrefs[cat.filename] = {(l['rel'], l['href']) for l in cat.data['links']}
+        if (rel, href) not in links:
+            cat.data['links'].append({'rel': rel, 'href': href})
+            links.add((rel, href))
+            self.new_links.setdefault(cat.filename, []).append((rel, href, target))
+            self._touch(cat)
+        return cat
+
+    def _unlink_failed(self, cat, failed):
+        """Remove links added during the batch to objects which failed to be written"""
+        for rel, href, target in self.new_links.get(cat.filename, []):
+            if target in failed:
+                cat.data['links'] = [l for l in cat.data['links'] if not (l['rel'] == rel and l['href'] == href)]
+
+    def _create_catalog(self, parent, name, fname):
+        """Create a new sub-catalog of ``parent`` (see ``Catalog.add_catalog``)"""
+        child_path = os.path.dirname(fname)
+        subcat = Catalog.create(id=name, description='%s catalog' % name)
+        subcat.add_link('self', os.path.join(self.endpoint, os.path.relpath(fname, self.root_path)))
+        subcat.add_link('root', os.path.relpath(self.root_link, child_path))
+        subcat.add_link('parent', os.path.relpath(parent.filename, child_path))
+        subcat.filename = fname
+        self._add_link(parent, 'child', '%s/catalog.json' % name, fname)
+
+        self._touch(subcat)
+        return subcat
+
+    def parent_catalog(self, path):
+        """Given the (substituted) path to a new item, find or create its parent catalog"""
+        return self.catalog_chain(path)[-1]
+
+    def catalog_chain(self, path):
+        """Given the (substituted) path to a new item, find or create every catalog from the collection to its parent"""
+        cat = self.collection
+        chain = [cat]
+        for name in [x for x in path.split('/') if x]:
+            fname = os.path.join(cat.path, name, 'catalog.json')
+            try:
+                subcat = self._open(fname)
+            except STACError:
+                subcat = self.catalogs[fname] = self._create_catalog(cat, name, fname)
+            cat = subcat
+            chain.append(cat)
+        return chain
+
+    def add_item(self, item, path='', filename='${id}'):
+        """Add an item to the collection (nothing is written until ``save`` is called)"""
+        subpath = self.render_item(item, path, filename)
+        self.link_item(item.filename, subpath)
+        return item
+
+    def render_item(self, item, path='', filename='${id}'):
+        """
+        Set the filename and the links of an item, and add it to the items to save, without linking it into its
+        catalog (see ``link_item``).  Returns the (substituted) path of its sub-catalog.
+        """
+        item_fname = os.path.join(self.collection.path, item.get_filename(path, filename))
+        item_path = os.path.dirname(item_fname)
+        subpath = item.substitute(path)
+        parent_fname = os.path.join(self.collection.path, *[x for x in subpath.split('/') if x], 'catalog.json')
+
+        # Create links from item
+        item.clean_hierarchy()
+        item.add_link('self', os.path.join(self.endpoint, os.path.relpath(item_fname, self.root_path)))
+        item.add_link('root', os.path.relpath(self.root_link, item_path))
+        item.add_link('parent', os.path.relpath(parent_fname, item_path))
+        item.add_link('collection', os.path.relpath(self.collection.filename, item_path))
+        item.filename = item_fname
+        self.items[item_fname] = item
+        # Failed writes are still reported by ``save`` if the item isn't linked.
+        self.ancestors.setdefault(item_fname, [])
+        return subpath
+
+    def link_item(self, item_fname, path):
+        """
+        Link an item (which is saved separately) into the catalog at the given (substituted) path, creating missing
+        catalogs.  Returns the item's parent catalog.
+        """
+        chain = self.catalog_chain(path)
+        parent = chain[-1]
+        page = self._add_link(parent, 'item', os.path.relpath(item_fname, parent.path), item_fname)
+        self.ancestors[item_fname] = [x.filename for x in chain + [page]]
+        return parent
+
+    def defer_ancestors(self):
+        """
+        Only save the new items and the sub-catalogs which directly contain them, leaving every other catalog to be
+        updated separately.  Returns the paths (relative to the collection) of those sub-catalogs, which must still be
+        linked into their ancestors with ``link_catalogs``.
+        """
+        # The pages of a catalog are in its directory.
+        leaves = {os.path.dirname(chain[-1]) for chain in self.ancestors.values()}
+        self.dirty = {k: v for k, v in self.dirty.items() if os.path.dirname(k) in leaves}
+        return sorted(os.path.relpath(x, self.collection.path) for x in leaves if x != self.collection.path)
+
+    def link_catalogs(self, paths):
+        """
+        Link existing sub-catalogs (paths relative to the collection, see ``defer_ancestors``) into their ancestors,
+        creating missing intermediate catalogs.  Sub-catalogs which don't exist are skipped.  Returns the filenames of
+        the linked sub-catalogs.
+        """
+        linked = []
+        for path in paths:
+            names = [x for x in path.split('/') if x]
+            fname = os.path.join(self.collection.path, *names, 'catalog.json')
+            try:
+                open_catalog(fname)
+            except STACError:
+                print(f"Skipping missing catalog {fname}")
+                continue
+            chain = self.catalog_chain('/'.join(names[:-1]))
+            page = self._add_link(chain[-1], 'child', '%s/catalog.json' % names[-1], fname)
+            self.ancestors[fname] = [x.filename for x in chain + [page]]
+            linked.append(fname)
+        return linked
+
+    def save(self):
+        """
+        Save every new item, then every touched catalog exactly once.  Objects at the same depth are independent and
+        are written concurrently, but each level is finished before its parents are written so a catalog never links
+        to an item or sub-catalog which doesn't exist yet (links added to objects which failed to be written are
+        dropped).  Returns the filenames of items (or sub-catalogs linked with ``link_catalogs``) which failed to be
+        saved, or whose catalogs failed to be saved.
+        """
+        failed = set(storage.write_many([(fname, item.data) for fname, item in self.items.items()], cache=False))
+
+        levels = {}
+        for fname, cat in self.dirty.items():
+            levels.setdefault((-depth(fname), fname not in self.new_pages), []).append(cat)
+        for level in sorted(levels):
+            for cat in levels[level]:
+                self._unlink_failed(cat, failed)
+                lasts = [l for l in cat.data['links'] if l['rel'] == 'last']
+                cat.data['links'] = [l for l in cat.data['links'] if l['rel'] != 'last'] + lasts[-1:]
+            failed.update(storage.write_many([(cat.filename, cat.data) for cat in levels[level]]))
+
+        failed_items = [x for x in self.ancestors if x in failed or failed.intersection(self.ancestors[x])]
+
+        self.items = {}
+        self.dirty = {}
+        self.new_links = {}
+        self.ancestors = {}
+        self.new_pages = set()
+        self.hrefs = {}
+        return failed_items
+
+
+class Journal(object):
+    """
+    Write-ahead journal of the items saved into a collection without being linked into its catalogs.  Each batch of
+    items is recorded in a new immutable object next to the collection's root catalog, and ``compact`` later links
+    the items of every outstanding journal object into the catalogs in a single pass, so item writes don't wait on
+    catalog rewrites.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.path = os.path.join(collection.path, 'stac_updater_journal')
+
+    def append(self, items, name):
+        """Record saved items, as (item filename, sub-catalog path), in a new journal object"""
+        # Named by time first, so objects are compacted in the order they were written.
+        url = os.path.join(self.path, '%013d-%s.json' % (time.time() * 1000, name))
+        storage.write_json(url, {'items': items}, cache=False)
+        return url
+
+    def compact(self, limit=1000):
+        """
+        Link the items of (up to ``limit``) outstanding journal objects into the collection's catalogs and delete the
+        compacted objects.  Items which failed to be linked are journaled again for the next compaction.  Items are
+        only linked twice if an object can't be deleted (a no-op, except in paged catalogs where the first link may
+        be on an earlier page).  Returns (number of objects compacted, number of items linked, number of objects left).
+        """
+        urls = storage.list_objects(self.path)
+        batch = CollectionBatch(self.collection)
+        entries = {}
+        for url in urls[:limit]:
+            try:
+                entries[url] = storage.read_json(url, cache=False)['items']
+            except STACError as e:
+                print(f"Skipping journal object {url}: {e}")
+                continue
+            for item_fname, path in entries[url]:
+                batch.link_item(item_fname, path)
+
+        failed = set(batch.save())
+        done = []
+        for url, items in entries.items():
+            retry = [x for x in items if x[0] in failed]
+            if retry:
+                try:
+                    # Keeps the name of the original object (after its timestamp), so the name stays unique.
+                    self.append(retry, os.path.basename(url).split('-', 1)[1][:-len('.json')])
+                except Exception as e:
+                    print(f"Failed to journal {len(retry)} items of {url} again: {e}")
+                    continue
+            done.append(url)
+
+        failed_deletes = storage.delete_many(done)
+        linked = sum(1 for url in done for x in entries[url] if x[0] not in failed)
+        return len(done) - len(failed_deletes), linked, len(storage.list_objects(self.path))
+
+
+class ItemIndex(object):
+    """
+    Index of the items already ingested into a collection ({item id: content hash}), used to skip re-delivered
+    items.  The index is split into JSON objects stored next to the collection's root catalog, keyed by the first
+    ``prefix`` hex digits of the hash of the item ID (65536 shards by default), so shards stay small however large the
+    collection grows and each batch only reads and writes the shards of its own items.  Concurrent updaters may
+    overwrite each other's additions, in which case a duplicate is simply ingested again.
+    """
+
+    def __init__(self, collection, prefix=4):
+        self.path = os.path.join(collection.path, 'stac_updater_index')
+        self.prefix = prefix
+        self._shards = {}
+        self._dirty = set()
+
+    @staticmethod
+    def item_hash(data):
+        """Hash of an item's content, ignoring the links rewritten when it is added to the collection"""
+        content = json.dumps({k: v for k, v in data.items() if k != 'links'}, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+    def _shard(self, item_id):
+        fname = os.path.join(self.path, '%s.json' % hashlib.sha1(item_id.encode('utf-8')).hexdigest()[:self.prefix])
+        if fname not in self._shards:
+            try:
+                # Shards aren't cached, there are far too many of them and they would push the catalogs out.
+                self._shards[fname] = storage.read_json(fname, cache=False)['items']
+            except STACError:
+                self._shards[fname] = {}
+        return fname, self._shards[fname]
+
+    def is_duplicate(self, item_id, item_hash):
+        """True if an item with the same ID and content (see ``item_hash``) was already ingested"""
+        return self._shard(item_id)[1].get(item_id) == item_hash
+
+    def add(self, item_id, item_hash):
+        fname, items = self._shard(item_id)
+        items[item_id] = item_hash
+        self._dirty.add(fname)
+
+    def save(self):
+        """Save the shards which changed, returning {filename: exception} of the shards which failed to save"""
+        errors = storage.write_many([(fname, {'items': self._shards[fname]}) for fname in self._dirty], cache=False)
+        self._dirty = set()
+        return errors
@@ -3,6 +3,7 @@ import re
 import shutil
 import subprocess
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 import yaml
@@ -13,6 +14,86 @@ from stac_updater import resources
 sls_template_path = os.path.join(os.path.dirname(__file__), '..', 'serverless_template.yml')
 sls_config_path = os.path.join(os.path.dirname(__file__), '..', 'serverless.yml')
 notification_topic_name = 'stacUpdaterNotifications'
+# Options of each collection of an `update-collections` manifest (and their defaults).
+manifest_options = {'root': None, 'long_poll': False, 'concurrency': None, 'path': None, 'filename': None,
+                    'deduplicate': False, 'fifo': False, 'page_size': None, 'direct': False, 'journal': None}
+# Settings of the update_collection functions written by `tune`: of the function, and of its SQS event.
+tuned_function_settings = ('memorySize', 'reservedConcurrency')
+tuned_event_settings = ('batchSize', 'maximumBatchingWindow')
+
+def resource_name(collection_id):
+    """Prefix of the names of a collection's resources and functions"""
+    pattern = re.compile('[\W_]+')
+    return pattern.sub('', collection_id)
+
+def collection_resources(collection_id, root, long_poll=False, concurrency=None, path=None, filename=None,
+                         deduplicate=False, fifo=False, page_size=None, direct=False, journal=None):
+    """Name and AWS resources of the updater of a collection (a concurrency of 1 unless given)"""
+    if fifo and journal:
+        raise click.UsageError("--journal and --fifo can't be combined, the compactor already is the only writer.")
+    filter_rule = {'collection': [collection_id]}
+    name = resource_name(collection_id)
+
+    concurrency = 1 if concurrency is None else concurrency
+    return name, resources.update_collection(name, root, filter_rule, long_poll, concurrency, path, filename,
+                                             deduplicate, fifo, page_size, direct, journal)
+
+def keep_tuned_settings(deployed, func, explicit=()):
+    """
+    Copy the settings written by `tune` from the deployed update_collection function into its new definition, unless
+    they are set ``explicit``ly.  Settings tuned for another queue type or writer mode (--fifo, --journal) are dropped.
+    """
+    if any(bool(deployed.get('environment', {}).get(k)) != bool(func['environment'].get(k))
+           for k in ('FIFO_QUEUE', 'JOURNAL')):
+        return
+    for key in tuned_function_settings:
+        if key in deployed and key not in explicit:
+            func[key] = deployed[key]
+    deployed_event = (deployed.get('events') or [{}])[0].get('sqs', {})
+    for key in tuned_event_settings:
+        if key in deployed_event and key not in explicit:
+            func['events'][0]['sqs'][key] = deployed_event[key]
+
+def add_collection(sls_config, collection_id, name, aws_resources, explicit=()):
+    """
+    Merge the resources of a collection's updater into the service config, returns False if nothing changed.  The
+    settings tuned by `tune` are kept (see ``keep_tuned_settings``), except those in ``explicit``.
+    """
+    sls_resources = sls_config['resources']['Resources']
+    updater = f"{name}_update_collection"
+    if updater in sls_config['functions'] and updater in aws_resources['functions']:
+        keep_tuned_settings(sls_config['functions'][updater], aws_resources['functions'][updater], explicit)
+    kickoff_env = sls_config['functions']['kickoff'].setdefault('environment', {})
+    queue_routes = json.loads(kickoff_env.get('QUEUE_ROUTES') or kickoff_env.get('FIFO_QUEUES', '{}'))
+
+    # Collections deployed again through SNS are no longer routed by kickoff.
+    routes = {k: v for k, v in queue_routes.items() if k != collection_id}
+    stale = []
+    if 'queue_routes' in aws_resources:
+        # Tell kickoff to send the collection's items straight to its queue.
+        routes.update(aws_resources['queue_routes'])
+        stale = [x for x in (f"{name}SnsSub", f"{name}SqsPolicy") if x in sls_resources]
+
+    # The compactor of a collection which no longer uses --journal.
+    compactor = f"{name}_compact_collection"
+    if compactor in sls_config['functions'] and compactor not in aws_resources['functions']:
+        del sls_config['functions'][compactor]
+        stale.append(compactor)
+
+    changed = bool(stale) or 'FIFO_QUEUES' in kickoff_env or routes != queue_routes \
+        or any(sls_resources.get(k) != v for k, v in aws_resources['resources'].items()) \
+        or any(sls_config['functions'].get(k) != v for k, v in aws_resources['functions'].items())
+
+    for x in stale:
+        sls_resources.pop(x, None)
+    sls_resources.update(aws_resources['resources'])
+    sls_config['functions'].update(aws_resources['functions'])
+    kickoff_env.pop('FIFO_QUEUES', None)
+    if routes:
+        kickoff_env['QUEUE_ROUTES'] = json.dumps(routes)
+    else:
+        kickoff_env.pop('QUEUE_ROUTES', None)
+    return changed
 
 @click.group()
 def stac_updater():
@@ -25,30 +106,123 @@ def new_service():
 @stac_updater.command(name='update-collection', short_help="update a static collection")
 @click.option('--root', '-r', type=str, required=True, help="URL of collection.")
 @click.option('--long-poll/--short-poll', default=False, help="Enable long polling.")
-@click.option('--concurrency', type=int, default=1, help="Sets lambda concurrency limit when polling the queue.")
+@click.option('--concurrency', type=int, help="Sets lambda concurrency limit when polling the queue (default 1).")
 @click.option('--path', type=str, help="Pattern used by sat-stac to build sub-catalogs.")
 @click.option('--filename', type=str, help="Pattern used by sat-stac to build item name.")
-def update_collection(root, long_poll, concurrency, path, filename):
+@click.option('--deduplicate/--no-deduplicate', default=False, help="Skip items which were already ingested.")
+@click.option('--fifo/--no-fifo', default=False, help="Use a FIFO queue so sub-catalogs can be updated concurrently.")
+@click.option('--page-size', type=int, help="Split catalogs into pages of at most this many item/child links.")
+@click.option('--direct/--sns', default=False, help="Send items from kickoff straight to the queue, skipping SNS.")
+@click.option('--journal', type=str, help="Journal new links, compacted into the catalogs on this schedule.")
+def update_collection(root, long_poll, concurrency, path, filename, deduplicate, fifo, page_size, direct, journal):
     # Create a SQS queue for the collection
     # Subscribe SQS queue to SNS topic with filter policy on collection name
     # Configure lambda function and attach to SQS queue (use ENV variables to pass state)
 
-    name = Collection.open(root).id
-    filter_rule = {'collection': [name]}
-
-    pattern = re.compile('[\W_]+')
-    name = pattern.sub('', name)
+    collection_id = Collection.open(root).id
+    name, aws_resources = collection_resources(collection_id, root, long_poll, concurrency, path, filename,
+                                               deduplicate, fifo, page_size, direct, journal)
 
     with open(sls_config_path, 'r') as f:
         # Using unsafe load to preserve type.
         sls_config = yaml.unsafe_load(f)
 
-        aws_resources = resources.update_collection(name, root, filter_rule, long_poll, concurrency, path, filename)
-        sls_config['resources']['Resources'].update(aws_resources['resources'])
-        sls_config['functions'].update(aws_resources['functions'])
+        add_collection(sls_config, collection_id, name, aws_resources,
+                       explicit=() if concurrency is None else ('reservedConcurrency',))
+
+        with open(sls_config_path, 'w') as outf:
+            yaml.dump(sls_config, outf, indent=1)
+
+@stac_updater.command(name='update-collections', short_help="update the static collections of a manifest")
+@click.option('--manifest', '-m', type=click.Path(exists=True), required=True, help="YAML/JSON list of collections.")
+@click.option('--workers', type=int, default=16, help="Number of collections opened concurrently.")
+def update_collections(manifest, workers):
+    # Same as `update-collection` for every collection of the manifest, ex:
+    #   collections:
+    #     - root: https://stac.com/landsat-8-l1/catalog.json
+    #       path: "{landsat:path}/{landsat:row}"
+    #       concurrency: 10
+    #       long_poll: true
+    # Collections are opened concurrently and the service config is only rewritten once.
+    with open(manifest, 'r') as f:
+        entries = yaml.safe_load(f)
+    if isinstance(entries, dict):
+        entries = entries.get('collections')
+    if not isinstance(entries, list) or not entries:
+        raise click.ClickException(f"{manifest} must list collections (under `collections`).")
+
+    errors = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get('root'):
+            errors.append(f"collection {i}: missing `root`")
+        elif set(entry) - set(manifest_options):
+            errors.append(f"collection {i}: unknown options {sorted(set(entry) - set(manifest_options))}")
+    if errors:
+        raise click.ClickException("Invalid manifest:\n" + "\n".join(errors))
+
+    def open_collection(entry):
+        try:
+            return Collection.open(entry['root']).id, None
+        except Exception as e:
+            return None, f"{entry['root']}: {type(e).__name__}: {e}"
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(entries)))) as executor:
+        opened = list(executor.map(open_collection, entries))
+
+    collections = {}
+    names = {}
+    for entry, (collection_id, error) in zip(entries, opened):
+        if error:
+            errors.append(error)
+            continue
+        if collection_id in collections:
+            errors.append(f"{entry['root']}: collection {collection_id} is also at {collections[collection_id][0]}")
+            continue
+        name, aws_resources = collection_resources(collection_id, **{**manifest_options, **entry})
+        if name in names:
+            errors.append(f"{entry['root']}: collection {collection_id} has the same resource names ({name}) as "
+                          f"collection {names[name]}")
+            continue
+        names[name] = collection_id
+        explicit = ('reservedConcurrency',) if entry.get('concurrency') is not None else ()
+        collections[collection_id] = (entry['root'], name, aws_resources, explicit)
+    if errors:
+        raise click.ClickException("Failed to resolve collections:\n" + "\n".join(errors))
+
+    with open(sls_config_path, 'r') as f:
+        # Using unsafe load to preserve type.
+        sls_config = yaml.unsafe_load(f)
 
+    changed = [collection_id for collection_id, (_, name, aws_resources, explicit) in collections.items()
+               if add_collection(sls_config, collection_id, name, aws_resources, explicit)]
+    if changed:
         with open(sls_config_path, 'w') as outf:
             yaml.dump(sls_config, outf, indent=1)
+    print(f"Updated {len(changed)} collections ({len(collections) - len(changed)} unchanged).")
+
+@stac_updater.command(name='paginate', short_help="split the catalogs of a collection into pages")
+@click.option('--root', '-r', type=str, required=True, help="URL of collection.")
+@click.option('--page-size', type=int, required=True, help="Maximum number of item/child links per page.")
+def paginate(root, page_size):
+    # Reshape existing catalogs for `update-collection --page-size` (use the same page size).
+    from stac_updater import catalog
+
+    written = catalog.paginate(root, page_size)
+    print(f"Wrote {len(written)} catalogs and pages.")
+
+@stac_updater.command(name='backfill', short_help="ingest an archive of STAC Items directly into a collection")
+@click.option('--root', '-r', type=str, required=True, help="URL of collection.")
+@click.option('--source', '-s', type=str, required=True, help="Directory, S3 prefix or NDJSON file of STAC Items.")
+@click.option('--path', type=str, help="Pattern used by sat-stac to build sub-catalogs.")
+@click.option('--filename', type=str, help="Pattern used by sat-stac to build item name.")
+@click.option('--workers', type=int, help="Number of worker processes (defaults to the number of CPUs).")
+@click.option('--chunk-size', type=int, default=500, help="Number of STAC Items per unit of work.")
+@click.option('--checkpoint', type=str, default='backfill.checkpoint', help="Progress file used to resume a backfill.")
+def backfill(root, source, path, filename, workers, chunk_size, checkpoint):
+    from stac_updater import backfill
+
+    linked, failures = backfill.backfill(root, source, path, filename, workers, chunk_size, checkpoint)
+    print(f"Added {linked} STAC Items ({failures} failed).")
 
 @stac_updater.command(name='update-dynamic-catalog', short_help="update a dynamic catalog")
 @click.option('--arn', type=str, help="ARN of sat-api ingest lambda function.")
@@ -94,12 +268,12 @@ def modify_kickoff(type, bucket_name, topic_name):
     else:
         raise ValueError("The `type` parameter must be one of ['s3', 'lambda'].")
 
-    # Add kickoff source event to environment
-    kickoff_func.update({'environment': {
-        'EVENT_SOURCE': type
-    }})
     with open(sls_config_path, 'r') as f:
         sls_config = yaml.unsafe_load(f)
+        # Add kickoff source event to environment (keeping the routing table of update-collection).
+        kickoff_env = sls_config['functions']['kickoff'].get('environment', {})
+        kickoff_env.update({'EVENT_SOURCE': type})
+        kickoff_func.update({'environment': kickoff_env})
         sls_config['functions']['kickoff'].update(kickoff_func)
 
         if type == 'lambda' and 'events' in sls_config['functions']['kickoff']:
@@ -124,6 +298,40 @@ def add_notifications():
         with open(sls_config_path, 'w') as outf:
             yaml.dump(sls_config, outf, indent=1)
 
+@stac_updater.command(name='add-subscriptions', short_help="notify subscribers of the items in their area of interest.")
+@click.option('--registry', type=str, required=True, help="URL of the JSON registry of subscriptions.")
+@click.option('--ttl', type=int, default=300, help="Seconds a loaded registry is used before it is read again.")
+def add_subscriptions(registry, ttl):
+    with open(sls_config_path, 'r') as f:
+        sls_config = yaml.unsafe_load(f)
+        sls_config['provider']['environment'].update({
+            'SUBSCRIPTIONS': registry,
+            'SUBSCRIPTIONS_TTL': str(ttl)
+        })
+
+        with open(sls_config_path, 'w') as outf:
+            yaml.dump(sls_config, outf, indent=1)
+
+@stac_updater.command(name='add-claim-check', short_help="send large STAC Items through S3 instead of SNS/SQS.")
+@click.option('--bucket', type=str, required=True, help="Name of the bucket created to store STAC Items.")
+@click.option('--threshold', type=int, default=200 * 1024,
+              help="Size (bytes) from which items are stored in S3 (0 for all items).")
+@click.option('--expiration', type=int, default=7, help="Number of days stored items are kept.")
+def add_claim_check(bucket, threshold, expiration):
+    with open(sls_config_path, 'r') as f:
+        sls_config = yaml.unsafe_load(f)
+        sls_config['resources']['Resources'].update({
+            'claimCheckBucket': resources.claim_check_bucket(bucket, expiration)
+        })
+
+        sls_config['provider']['environment'].update({
+            'CLAIM_CHECK_BUCKET': bucket,
+            'CLAIM_CHECK_THRESHOLD': str(threshold)
+        })
+
+        with open(sls_config_path, 'w') as outf:
+            yaml.dump(sls_config, outf, indent=1)
+
 @stac_updater.command(name='add-logging', short_help="Pipe cloudwatch logs into elasticsearch.")
 @click.option('--es_host', type=str, required=True, help="Domain name of elasticsearch instance.")
 def add_logging(es_host):
@@ -136,7 +344,7 @@ def add_logging(es_host):
         # Create lambda function
         service_name = sls_config['custom']['service-name']
         service_stage = sls_config['custom']['stage']
-        collection_names = [x.split('_')[0] for x in list(sls_config['functions']) if x not in ['kickoff', 'es_log_ingest']]
+        collection_names = [x.split('_')[0] for x in list(sls_config['functions']) if x.endswith('_update_collection')]
         func = resources.lambda_cloudwatch_trigger("es_log_ingest", service_name, service_stage, collection_names)
         func.update({'environment': {'ES_HOST': es_host}})
         sls_config['functions'].update({'es_log_ingest': func})
@@ -150,6 +358,66 @@ def add_logging(es_host):
         with open(sls_config_path, 'w') as outf:
             yaml.dump(sls_config, outf, indent=1)
 
+@stac_updater.command(name='tune', short_help="tune the collection updaters from their logs")
+@click.option('--logs', type=click.Path(exists=True), help="Log documents exported from ES (instead of querying ES).")
+@click.option('--days', type=int, default=7, help="Number of days of logs used (when querying ES).")
+@click.option('--max-concurrency', type=int, default=10, help="Highest concurrency recommended (FIFO collections).")
+@click.option('--max-window', type=int, default=20, help="Longest batching window (seconds) recommended.")
+@click.option('--dry-run', is_flag=True, help="Only print the recommendations.")
+def tune(logs, days, max_concurrency, max_window, dry_run):
+    # Recommend the batch size, batching window, memory size and concurrency of each update_collection function from
+    # the logs indexed by `add-logging`, and write them into serverless.yml.
+    from stac_updater import tuning
+
+    with open(sls_config_path, 'r') as f:
+        sls_config = yaml.unsafe_load(f)
+
+    if logs:
+        docs = tuning.read_log_file(logs)
+    else:
+        if 'es_log_ingest' not in sls_config['functions']:
+            raise click.ClickException("Logging isn't enabled (see `add-logging`), use --logs with exported logs.")
+        from stac_updater import logging
+        logging.ES_HOST = sls_config['functions']['es_log_ingest']['environment']['ES_HOST']
+        logging.REGION = logging.REGION or sls_config['custom']['region']
+        docs = tuning.search_logs(logging.get_es(), days)
+
+    changed = False
+    for collection_id, stats in sorted(tuning.collection_stats(docs).items()):
+        func = sls_config['functions'].get(f"{resource_name(collection_id)}_update_collection")
+        if not func:
+            print(f"{collection_id}: no update_collection function in {sls_config_path}, skipped.")
+            continue
+        environment = func.get('environment', {})
+        fifo = 'FIFO_QUEUE' in environment
+        # Journal mode updaters only write items, their catalogs are updated by the compactor.
+        concurrent = fifo or environment.get('JOURNAL') == 'true'
+        settings = tuning.recommend(stats, fifo, func.get('timeout', 6), max_concurrency, max_window, concurrent)
+        if not settings:
+            print(f"{collection_id}: no setting fits in memory and within the timeout, skipped.")
+            continue
+
+        print(f"{collection_id}: {stats['invocations']} invocations, {stats['items']} items, "
+              f"peak {stats['peak_rate']:.2f} items/sec, ${stats['cost_per_item'] * 1e6:.2f} per million items -> "
+              f"batchSize {settings['batchSize']}, maximumBatchingWindow {settings['maximumBatchingWindow']} s, "
+              f"memorySize {settings['memorySize']} MB, concurrency {settings['concurrency']}, "
+              f"{settings['throughput'] * settings['concurrency']:.2f} items/sec, "
+              f"${settings['costPerItem'] * 1e6:.2f} per million items")
+
+        sqs_event = func['events'][0]['sqs']
+        sqs_event['batchSize'] = settings['batchSize']
+        if settings['maximumBatchingWindow']:
+            sqs_event['maximumBatchingWindow'] = settings['maximumBatchingWindow']
+        else:
+            sqs_event.pop('maximumBatchingWindow', None)
+        func['memorySize'] = settings['memorySize']
+        func['reservedConcurrency'] = settings['concurrency']
+        changed = True
+
+    if changed and not dry_run:
+        with open(sls_config_path, 'w') as outf:
+            yaml.dump(sls_config, outf, indent=1)
+
 @stac_updater.command(name='deploy', short_help="deploy service to aws.")
 def deploy():
     subprocess.call("docker build . -t stac-updater:latest", shell=True)
@@ -1,91 +1,545 @@
 import os
+import re
 import json
+import time
+import logging
+import hashlib
 import base64
 import gzip
+import contextlib
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
 
-import boto3
-from satstac import Collection, Item
+from stac_updater import stream, utils
 
-from stac_updater import utils
+# Clients and heavy dependencies (boto3, sat-stac, elasticsearch) are loaded on first use so each function only pays
+# for what it needs during a cold start.
+_clients = {}
+_clients_lock = threading.Lock()
 
-sns_client = boto3.client('sns')
-s3_res = boto3.resource('s3')
-
-ACCOUNT_ID = boto3.client('sts').get_caller_identity()['Account']
+ACCOUNT_ID = os.getenv('ACCOUNT_ID')
 REGION = os.getenv('REGION')
 NOTIFICATION_TOPIC = os.getenv('NOTIFICATION_TOPIC')
+DEDUPLICATE = os.getenv('DEDUPLICATE') == 'true'
+ITEM_INDEX_PREFIX = int(os.getenv('ITEM_INDEX_PREFIX', 4))
+KICKOFF_CONCURRENCY = int(os.getenv('KICKOFF_CONCURRENCY', 8))
+# Bulk files are published BULK_BATCH_SIZE items at a time, and handed off to a new invocation once less than
+# RESUME_MARGIN milliseconds remain.
+BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', 100))
+RESUME_MARGIN = int(os.getenv('RESUME_MARGIN', 10000))
+# Collections whose items kickoff sends straight to their queue instead of the SNS topic (see `update-collection
+# --direct` and `--fifo`), as {collection: {'queue', 'path'}}.  Items sent to a FIFO queue are grouped by the
+# sub-catalog they are added to.  FIFO_QUEUES is the name used by services which only routed FIFO queues.
+QUEUE_ROUTES = json.loads(os.getenv('QUEUE_ROUTES') or os.getenv('FIFO_QUEUES', '{}'))
+# FIFO queue of the collection updated by update_collection, and the message group which serializes updates to the
+# catalogs shared by several sub-catalogs.
+FIFO_QUEUE = os.getenv('FIFO_QUEUE')
+MERGE_GROUP = '~merge'
+# Claim-check mode (see `stac-updater add-claim-check`): STAC Items of at least CLAIM_CHECK_THRESHOLD bytes (all items
+# when 0) are stored once in CLAIM_CHECK_BUCKET and only a pointer travels through SNS/SQS.  update_collection keeps the
+# last CLAIM_CACHE_SIZE items it loaded.
+CLAIM_CHECK_BUCKET = os.getenv('CLAIM_CHECK_BUCKET')
+CLAIM_CHECK_THRESHOLD = int(os.getenv('CLAIM_CHECK_THRESHOLD', 200 * 1024))
+CLAIM_CACHE_SIZE = int(os.getenv('CLAIM_CACHE_SIZE', 32))
+_claims = collections.OrderedDict()
+# Journal mode (see `update-collection --journal`): items are saved and recorded in the collection's journal, and their
+# catalogs are only updated by the scheduled compact_collection function.
+JOURNAL = os.getenv('JOURNAL') == 'true'
+COMPACTION_LIMIT = int(os.getenv('COMPACTION_LIMIT', 1000))
+# Registry of spatial subscriptions (see `stac-updater add-subscriptions`), indexed once per warm container and read
+# again at most every SUBSCRIPTIONS_TTL seconds.  Items are delivered to NOTIFY_CONCURRENCY destinations at a time.
+SUBSCRIPTIONS = os.getenv('SUBSCRIPTIONS')
+SUBSCRIPTIONS_TTL = int(os.getenv('SUBSCRIPTIONS_TTL', 300))
+NOTIFY_CONCURRENCY = int(os.getenv('NOTIFY_CONCURRENCY', 8))
+_subscriptions = {}
 
-def kickoff(event, context):
-    event_source = os.getenv('EVENT_SOURCE')
+# Full payloads are only logged at DEBUG level (LOG_LEVEL), they may be large and CloudWatch bills by the byte.
+logging.basicConfig()
+logger = logging.getLogger('stac_updater')
+logger.setLevel(os.getenv('LOG_LEVEL', 'WARNING').upper())
 
-    # Load payload based on event source
-    if event_source == "s3":
-        bucket = event['Records'][0]['s3']['bucket']['name']
-        key = event['Records'][0]['s3']['object']['key']
-        content_object = s3_res.Object(bucket, key)
-        file_content = content_object.get()['Body'].read().decode('utf-8')
-        payload = json.loads(file_content)
-    elif event_source == "sns":
-        payload = json.loads(event['Records'][0]['Sns']['Message'])
-    else:
-        # Default is lambda
-        payload = event
+def get_client(service):
+    """Create a boto3 client on first use and re-use it for the lifetime of the container"""
+    if service not in _clients:
+        # Kickoff's worker threads may ask for the same client at once, and boto3's default session isn't thread-safe.
+        with _clients_lock:
+            if service not in _clients:
+                import boto3
+                _clients[service] = boto3.client(service)
+    return _clients[service]
+
+def account_id(context):
+    """AWS account ID, from the deploy-time environment or the ARN of the invoked function"""
+    if ACCOUNT_ID:
+        return ACCOUNT_ID
+    return context.invoked_function_arn.split(':')[4]
 
-    print(payload)
+def topic_arn(topic_name, context):
+    return f"arn:aws:sns:{REGION}:{account_id(context)}:{topic_name}"
 
+def queue_url(queue_name, context):
+    return f"https://sqs.{REGION}.amazonaws.com/{account_id(context)}/{queue_name}"
+
+def item_collection(payload):
+    if isinstance(payload, str):
+        return utils.item_collection(payload)
     try:
-        coll_name = payload['properties']['collection']
+        return payload['properties']['collection']
     except KeyError:
-        coll_name = payload['collection']
+        return payload['collection']
+
+def serialize(payload):
+    """STAC Item as sent in messages, items received as JSON text are forwarded without being parsed again"""
+    return payload if isinstance(payload, str) else utils.dumps(payload)
 
-    sns_client.publish(
-        TopicArn=f"arn:aws:sns:{REGION}:{ACCOUNT_ID}:newStacItemTopic",
-        Message=json.dumps(payload),
-        MessageAttributes={
+def claim_check(body):
+    """True if a message body is sent as a pointer (see CLAIM_CHECK_BUCKET)"""
+    return bool(CLAIM_CHECK_BUCKET) and len(body.encode('utf-8')) >= CLAIM_CHECK_THRESHOLD
+
+def message_body(payload):
+    """Serialized STAC Item, or a pointer to a copy of it stored in CLAIM_CHECK_BUCKET"""
+    body = serialize(payload)
+    if not claim_check(body):
+        return body
+    # Keyed by content, so an item published several times is only stored once.
+    key = f"claims/{hashlib.sha1(body.encode('utf-8')).hexdigest()}.json"
+    get_client('s3').put_object(Bucket=CLAIM_CHECK_BUCKET, Key=key, Body=body, ContentType='application/json')
+    return json.dumps({'claim': f"s3://{CLAIM_CHECK_BUCKET}/{key}"})
+
+def resolve_claim(url):
+    """Load a STAC Item stored in claim-check mode, from the cache of recently loaded items if possible"""
+    if url in _claims:
+        _claims.move_to_end(url)
+    else:
+        bucket, _, key = url[5:].partition('/')
+        _claims[url] = get_client('s3').get_object(Bucket=bucket, Key=key)['Body'].read()
+        while len(_claims) > CLAIM_CACHE_SIZE:
+            _claims.popitem(last=False)
+    # Items are modified when they are added to a collection, so every call gets its own copy.
+    return utils.loads(_claims[url])
+
+def item_message(payload, body=None):
+    """Build the SNS message for a STAC Item, with the collection name as a message attribute (for filtering)"""
+    return {
+        'Message': body or serialize(payload),
+        'MessageAttributes': {
             'collection': {
                 'DataType': 'String',
-                'StringValue': coll_name
+                'StringValue': item_collection(payload)
             }
         }
-    )
+    }
+
+def message_group(payload, pattern):
+    """
+    FIFO message group of a STAC Item: the sub-catalog it is added to, so each sub-catalog is only updated by one
+    invocation at a time.
+    """
+    from satstac import Item
+
+    if pattern:
+        # The sub-catalog is rendered by sat-stac, so the item has to be parsed.
+        item = Item(utils.loads(payload) if isinstance(payload, str) else payload)
+        group = item.substitute(utils.sat_stac_pattern(pattern))
+    else:
+        group = ''
+    # Group IDs are limited to 128 printable ASCII characters.
+    group = re.sub(r'[^!-~]', '_', group) or item_collection(payload)
+    return group if len(group) <= 128 else hashlib.sha1(group.encode('utf-8')).hexdigest()
+
+def fifo_message(payload, pattern, body=None):
+    """Build the SQS message for a STAC Item of a collection updated through a FIFO queue"""
+    return {
+        'MessageBody': body or serialize(payload),
+        'MessageGroupId': message_group(payload, pattern)
+    }
+
+def queue_message(payload, route, body=None):
+    """Build the SQS message for a STAC Item routed straight to the queue of its collection"""
+    if route['queue'].endswith('.fifo'):
+        return fifo_message(payload, route.get('path'), body)
+    return {'MessageBody': body or serialize(payload)}
+
+def ingest_object(bucket, key, context, offset=0, format=None):
+    """
+    Stream the STAC Items of a S3 object (a single item, NDJSON, or FeatureCollection/ItemCollection, optionally
+    gzipped) and publish them in batches.  If the invocation is about to time out, kickoff is re-invoked to resume
+    reading from the byte offset of the next unpublished item.  Returns the number of published items.
+    """
+    format = format or stream.detect_format(key)
+    kwargs = {'Range': f"bytes={offset}-"} if offset and not stream.is_gzipped(key) else {}
+    if offset and stream.is_gzipped(key):
+        # Gzip streams can't be seeked: every resumed invocation downloads and decompresses the file from the start.
+        logger.warning("Resuming gzipped s3://%s/%s from decompressed byte %d requires reading it again from the "
+                       "start, split large files or store them uncompressed.", bucket, key, offset)
+    body = get_client('s3').get_object(Bucket=bucket, Key=key, **kwargs)['Body']
+    items = stream.iter_items(stream.open_stream(body, key, offset), format, offset, raw=True)
+
+    count = 0
+    payloads = []
+    for payload, end in items:
+        payloads.append(payload)
+        if len(payloads) < BULK_BATCH_SIZE:
+            continue
+        count += publish_items(payloads, context)
+        payloads = []
+        if context and context.get_remaining_time_in_millis() < RESUME_MARGIN:
+            resume = {'bucket': bucket, 'key': key, 'offset': end, 'format': stream.resume_format(format)}
+            print(f"Resuming s3://{bucket}/{key} from byte {end} in a new invocation.")
+            get_client('lambda').invoke(
+                FunctionName=context.invoked_function_arn,
+                InvocationType='Event',
+                Payload=json.dumps({'resume': resume})
+            )
+            break
+    else:
+        count += publish_items(payloads, context)
+    return count
+
+def publish_items(payloads, context):
+    """
+    Publish a batch of STAC Items to the topic which fans out to each collection's queue, or straight to the queue of
+    their collection (see QUEUE_ROUTES) with one SendMessageBatch per 10 items of each queue.  Items may be given parsed
+    or as JSON text, which is forwarded unchanged.
+    """
+    if not payloads:
+        return 0
+    if CLAIM_CHECK_BUCKET:
+        with ThreadPoolExecutor(max_workers=max(1, min(KICKOFF_CONCURRENCY, len(payloads)))) as executor:
+            bodies = list(executor.map(message_body, payloads))
+    else:
+        bodies = [None] * len(payloads)
+
+    messages = []
+    queues = {}
+    for payload, body in zip(payloads, bodies):
+        route = QUEUE_ROUTES.get(item_collection(payload))
+        if route:
+            queues.setdefault(route['queue'], []).append(queue_message(payload, route, body))
+        else:
+            messages.append(item_message(payload, body))
+
+    failed = []
+    if messages:
+        failed += utils.publish_messages(get_client('sns'), topic_arn('newStacItemTopic', context), messages)
+    if queues:
+        # Every destination queue is sent to concurrently.
+        with ThreadPoolExecutor(max_workers=max(1, min(KICKOFF_CONCURRENCY, len(queues)))) as executor:
+            futures = [executor.submit(utils.send_messages, get_client('sqs'), queue_url(name, context), queue_messages)
+                       for name, queue_messages in queues.items()]
+        for future in futures:
+            failed += future.result()
+    if failed:
+        raise RuntimeError(f"Failed to publish {len(failed)} of {len(payloads)} items.")
+    return len(payloads)
+
+def record_id(record, event_source):
+    """Identify a kickoff event record in the per-record results"""
+    if event_source == "s3":
+        return f"s3://{record['s3']['bucket']['name']}/{record['s3']['object']['key']}"
+    elif event_source == "sns":
+        return record['Sns']['MessageId']
+    elif event_source == "resume":
+        return f"s3://{record['bucket']}/{record['key']}@{record['offset']}"
+    return None
+
+def kickoff_record(record, event_source, context):
+    """Publish the STAC Item(s) carried by a single kickoff event record, returning the number of items"""
+    if event_source == "s3":
+        return ingest_object(record['s3']['bucket']['name'], unquote_plus(record['s3']['object']['key']), context)
+    elif event_source == "resume":
+        return ingest_object(context=context, **record)
+    elif event_source == "sns":
+        # Forwarded as is, only the collection is read from the message.
+        payload = record['Sns']['Message']
+    else:
+        # Default is lambda
+        payload = record
+
+    logger.debug("Publishing %s", payload)
+    return publish_items([payload], context)
+
+def kickoff(event, context):
+    event_source = os.getenv('EVENT_SOURCE')
+
+    # S3 and SNS events may batch several records, a lambda invocation carries a single STAC Item.
+    if 'resume' in event:
+        # Continue reading a bulk file where a previous invocation stopped.
+        event_source = "resume"
+        records = [event['resume']]
+    else:
+        records = event['Records'] if event_source in ("s3", "sns") else [event]
+
+    # Load and publish every record concurrently.
+    with ThreadPoolExecutor(max_workers=max(1, min(KICKOFF_CONCURRENCY, len(records)))) as executor:
+        futures = [executor.submit(kickoff_record, record, event_source, context) for record in records]
+
+    results = []
+    for record, future in zip(records, futures):
+        result = {'id': record_id(record, event_source), 'status': 'success'}
+        try:
+            result['itemCount'] = future.result()
+        except Exception as e:
+            result.update({'status': 'failed', 'error': f"{type(e).__name__}: {e}"})
+            print(f"Failed to process record {result['id']}: {result['error']}")
+        results.append(result)
+
+    # S3 and SNS invoke kickoff asynchronously: raising is what gets the event retried (and sent to its DLQ).
+    failed = [x for x in results if x['status'] == 'failed']
+    if failed:
+        raise RuntimeError(f"Failed to process {len(failed)} of {len(records)} records: {json.dumps(results)}")
+    return {'records': results}
+
+def notification(item):
+    """SNS notification of an item added to the collection, pointing to the saved item in claim-check mode"""
+    message = utils.stac_to_sns(item.data)
+    if claim_check(message['Message']):
+        message['Message'] = json.dumps({'claim': item.links('self')[0]})
+    return message
+
+def subscription_index():
+    """
+    Spatial index of the subscription registry.  If the registry can't be read (or is invalid), the index loaded last
+    is kept until the registry is read successfully.
+    """
+    from stac_updater import spatial, storage
+
+    if not _subscriptions or time.time() - _subscriptions['loaded'] > SUBSCRIPTIONS_TTL:
+        try:
+            registry = storage.read_json(SUBSCRIPTIONS)
+            _subscriptions.update({
+                'index': spatial.SubscriptionIndex(registry['subscriptions']),
+                'loaded': time.time()
+            })
+        except Exception as e:
+            if not _subscriptions:
+                raise
+            print(f"Failed to load subscriptions from {SUBSCRIPTIONS}, using the previous registry: "
+                  f"{type(e).__name__}: {e}")
+    return _subscriptions['index']
+
+def notify_subscribers(items, context):
+    """
+    Send the notification of each item to the subscriptions whose area of interest intersects it, grouped by
+    destination topic or queue.  Returns the message IDs of the items which couldn't be delivered to every subscriber.
+    """
+    try:
+        index = subscription_index()
+    except Exception as e:
+        print(f"Failed to load subscriptions from {SUBSCRIPTIONS}: {type(e).__name__}: {e}")
+        return set(items)
+
+    failures = set()
+    destinations = {}
+    for message_id, item in items.items():
+        try:
+            matches = index.match(item.data)
+            message = notification(item) if matches else None
+        except Exception as e:
+            print(f"Failed to match message {message_id} to subscriptions: {type(e).__name__}: {e}")
+            failures.add(message_id)
+            continue
+        for subscription in matches:
+            if subscription.get('topic'):
+                destinations.setdefault(('topic', subscription['topic']), []).append((message_id, dict(message)))
+            else:
+                destinations.setdefault(('queue', subscription['queue']), []).append((message_id, {
+                    'MessageBody': message['Message'],
+                    'MessageAttributes': message['MessageAttributes']
+                }))
+
+    def send(kind, destination, messages):
+        if kind == 'topic':
+            return utils.publish_messages(get_client('sns'), destination, messages)
+        return utils.send_messages(get_client('sqs'), destination, messages)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(NOTIFY_CONCURRENCY, len(destinations)))) as executor:
+        futures = {key: executor.submit(send, *key, [x[1] for x in entries]) for key, entries in destinations.items()}
+
+    for key, entries in destinations.items():
+        failed = {id(x) for x in futures[key].result()}
+        failures.update(message_id for message_id, message in entries if id(message) in failed)
+    return failures
+
+@contextlib.contextmanager
+def timer(timings, stage):
+    """Add the time (ms) spent in a block to ``timings[stage]``"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + (time.perf_counter() - start) * 1000
 
 def update_collection(event, context):
+    from satstac import Item
+    from stac_updater import catalog, storage
+
     collection_root = os.getenv('COLLECTION_ROOT')
     path = os.getenv('PATH')
     filename = os.getenv('FILENAME')
 
     item_count = len(event['Records'])
-    stac_links = []
+    timings = {'open': 0, 'add': 0, 'save': 0, 'publish': 0}
 
+    # Open the collection once per invocation and save each touched catalog once at the end of the batch.
+    storage.reset_stats()
+    with timer(timings, 'open'):
+        col = catalog.open_collection(collection_root)
+        collection_name = col.id
+        batch = catalog.CollectionBatch(col)
+        # Index of items already ingested, used to skip re-delivered items.
+        index = catalog.ItemIndex(col, prefix=ITEM_INDEX_PREFIX) if DEDUPLICATE else None
+
+    kwargs = {}
+    if path:
+        kwargs.update({'path': utils.sat_stac_pattern(path)})
+    if filename:
+        kwargs.update({'filename': utils.sat_stac_pattern(filename)})
+    logger.debug("sat-stac patterns %s", kwargs)
+
+    # Failures are isolated to the record which caused them and reported back to SQS (ReportBatchItemFailures), so
+    # only failed messages are retried.
+    failures = []
+    items = {}
+    journaled = {}
+    hashes = {}
+    merges = {}
+    duplicates = 0
     for record in event['Records']:
-        stac_item = json.loads(record['body'])
+        try:
+            with timer(timings, 'add'):
+                stac_item = utils.loads(record['body'])
+                if 'claim' in stac_item:
+                    stac_item = resolve_claim(stac_item['claim'])
 
-        print(stac_item)
+                if 'merge' in stac_item:
+                    # Sub-catalogs to link into the catalogs they share with other sub-catalogs (FIFO queues only).
+                    merges[record['messageId']] = stac_item['merge']
+                    continue
+
+                logger.debug("Adding %s", stac_item)
+
+                if index:
+                    item_hash = (stac_item['id'], index.item_hash(stac_item))
+                    if index.is_duplicate(*item_hash) or item_hash in hashes.values():
+                        print(f"Skipping duplicate item {stac_item['id']}")
+                        duplicates += 1
+                        continue
+                    hashes[record['messageId']] = item_hash
+
+                if JOURNAL:
+                    item = items[record['messageId']] = Item(stac_item)
+                    journaled[record['messageId']] = batch.render_item(item, **kwargs)
+                else:
+                    items[record['messageId']] = batch.add_item(Item(stac_item), **kwargs)
+        except Exception as e:
+            print(f"Failed to add message {record['messageId']}: {type(e).__name__}: {e}")
+            failures.append(record['messageId'])
+
+    # With a FIFO queue each sub-catalog only has one writer at a time, but the catalogs above it are shared with other
+    # sub-catalogs: they are updated by the merge message group, which is processed by one invocation at a time.
+    leaves = batch.defer_ancestors() if FIFO_QUEUE and not JOURNAL else []
+
+    with timer(timings, 'save'):
+        failed_files = batch.save()
+    for message_id, item in list(items.items()):
+        if item.filename in failed_files:
+            failures.append(message_id)
+            del items[message_id]
+
+    if journaled and items:
+        # Items are only reported as added once they are in the journal, so the compactor will link them.
+        with timer(timings, 'save'):
+            try:
+                catalog.Journal(col).append([[item.filename, journaled[message_id]]
+                                             for message_id, item in items.items()], context.aws_request_id)
+            except Exception as e:
+                print(f"Failed to journal {len(items)} items: {type(e).__name__}: {e}")
+                failures.extend(items)
+                items = {}
+
+    if leaves and items:
+        with timer(timings, 'publish'):
+            failed = utils.send_messages(get_client('sqs'), queue_url(FIFO_QUEUE, context), [{
+                'MessageBody': json.dumps({'merge': leaves}),
+                'MessageGroupId': MERGE_GROUP,
+                'MessageDeduplicationId': context.aws_request_id
+            }])
+        if failed:
+            print(f"Failed to request a merge of {leaves}")
+            failures.extend(items)
+            items = {}
+
+    if merges:
+        with timer(timings, 'save'):
+            # Re-open the collection, the batch above may have linked new sub-catalogs into it (without saving them).
+            merge = catalog.CollectionBatch(catalog.open_collection(collection_root))
+            linked = {message_id: merge.link_catalogs(paths) for message_id, paths in merges.items()}
+            failed_files = merge.save()
+        failures.extend([message_id for message_id, fnames in linked.items() if set(fnames) & set(failed_files)])
+
+    stac_links = [item.links('self')[0] for item in items.values()]
+
+    # Send messages to SNS Topic if enabled
+    if NOTIFICATION_TOPIC and items:
+        with timer(timings, 'publish'):
+            messages = {}
+            for message_id, item in items.items():
+                try:
+                    messages[message_id] = notification(item)
+                except Exception as e:
+                    print(f"Failed to build the notification of message {message_id}: {type(e).__name__}: {e}")
+                    failures.append(message_id)
+            failed = utils.publish_messages(
+                get_client('sns'),
+                topic_arn(NOTIFICATION_TOPIC, context),
+                list(messages.values())
+            )
+        failed = {id(x) for x in failed}
+        failures.extend([message_id for message_id, message in messages.items() if id(message) in failed])
+
+    # Deliver items to the subscribers of the area they cover.
+    if SUBSCRIPTIONS and items:
+        with timer(timings, 'publish'):
+            failed = notify_subscribers(items, context)
+        failures.extend([message_id for message_id in failed if message_id not in failures])
+
+    # Only items which were fully ingested (and notified) are skipped when delivered again.
+    if index:
+        with timer(timings, 'save'):
+            for message_id in items:
+                if message_id not in failures:
+                    index.add(*hashes[message_id])
+            index.save()
+
+    print(f"LOGS CollectionName: {collection_name}\tItemCount: {item_count}\tCacheHits: {storage.STATS['hits']}\t"
+          f"CacheMisses: {storage.STATS['misses']}\tDuplicateCount: {duplicates}\t"
+          f"OpenDuration: {timings['open']:.2f} ms\tAddDuration: {timings['add']:.2f} ms\t"
+          f"SaveDuration: {timings['save']:.2f} ms\tPublishDuration: {timings['publish']:.2f} ms\t"
+          f"S3Gets: {storage.STATS['gets']}\tS3Puts: {storage.STATS['puts']}\t"
+          f"BytesRead: {storage.STATS['bytes_read']}\tBytesWritten: {storage.STATS['bytes_written']}\t"
+          f"ItemLinks: {json.dumps(stac_links)}")
+
+    if failures and len(failures) == item_count:
+        raise RuntimeError(f"Failed to process all {item_count} messages.")
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]}
 
-        col = Collection.open(collection_root)
-        collection_name = col.id
-        kwargs = {'item': Item(stac_item)}
-        if path:
-            kwargs.update({'path': '$' + '/$'.join(path.split('/'))})
-        if filename:
-            kwargs.update({'filename': '$' + '/$'.join(filename.split('/'))})
-        print(kwargs)
-        col.add_item(**kwargs)
-        col.save()
-
-        stac_links.append(kwargs['item'].links('self')[0])
-
-        # Send message to SNS Topic if enabled
-        if NOTIFICATION_TOPIC:
-            kwargs = utils.stac_to_sns(kwargs['item'].data)
-            kwargs.update({
-                'TopicArn': f"arn:aws:sns:{REGION}:{ACCOUNT_ID}:{NOTIFICATION_TOPIC}"
-            })
-            sns_client.publish(**kwargs)
 
+def compact_collection(event, context):
+    """Link the items journaled by update_collection into the collection's catalogs (scheduled)"""
+    from stac_updater import catalog, storage
 
-    print(f"LOGS CollectionName: {collection_name}\tItemCount: {item_count}\tItemLinks: {stac_links}")
+    storage.reset_stats()
+    start = time.perf_counter()
+    journal = catalog.Journal(catalog.open_collection(os.getenv('COLLECTION_ROOT')))
+    compacted, linked, pending = journal.compact(COMPACTION_LIMIT)
 
+    print(f"COMPACT JournalObjects: {compacted}\tItemLinks: {linked}\tPendingObjects: {pending}\t"
+          f"CompactDuration: {(time.perf_counter() - start) * 1000:.2f} ms\t"
+          f"S3Gets: {storage.STATS['gets']}\tS3Puts: {storage.STATS['puts']}")
+    return {'compacted': compacted, 'linked': linked, 'pending': pending}
 
 def es_log_ingest(event, context):
     from stac_updater import logging
@@ -96,4 +550,5 @@ def es_log_ingest(event, context):
     payload = json.loads(uncompressed_payload)
 
     # Index to ES
-    logging.index_logs(payload)
\ No newline at end of file
+    errors = logging.index_logs(payload)
+    return {'errors': errors}
\ No newline at end of file
@@ -1,96 +1,223 @@
-import ast
 from datetime import datetime
+import json
+import logging
+import math
 import os
+import re
 
 import boto3
-from elasticsearch import Elasticsearch, RequestsHttpConnection, ConflictError
+from elasticsearch import Elasticsearch, RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
 
 
 ES_HOST = os.getenv('ES_HOST')
 REGION = os.getenv('REGION')
 
-if ES_HOST:
-    cred = boto3.Session().get_credentials()
-    awsauth = AWS4Auth(cred.access_key, cred.secret_key, REGION, 'es', session_token=cred.token)
-    es = Elasticsearch(
-        hosts=[{'host': ES_HOST, 'port': 443}],
-        http_auth=awsauth,
-        use_ssl=True,
-        verify_certs=True,
-        connection_class=RequestsHttpConnection
-    )
+INDEX_PREFIX = 'stac_updater_logs_'
+TEMPLATE_NAME = 'stac_updater_logs'
+# Per-collection rollups of the invocations of each minute and hour, for dashboards and alerting.
+ROLLUP_INDEX = 'stac_updater_rollups'
+ROLLUP_SCRIPT = 'stac_updater_rollup'
+ROLLUP_INTERVALS = {'minute': 60 * 1000, 'hour': 60 * 60 * 1000}
+# Durations are counted in buckets (gamma^(i-1), gamma^i] ms, so quantiles are within 1% of the exact value and
+# rollups of different invocations are merged by adding the counts of each bucket.
+SKETCH_GAMMA = 1.02
+ROLLUP_QUANTILE = 0.95
 
-def create_index(index_name):
-    """Create a new ES index with given name"""
-    if not es.indices.exists(index_name):
-        mapping = {
-            "mappings": {
-                "log": {
-                    "properties": {
-                        "id": {"type": "text"},
-                        "BilledDuration": {"type": "float"},
-                        "CollectionName": {"type": "text"},
-                        "Duration": {"type": "float"},
-                        "ItemCount": {"type": "integer"},
-                        "ItemLinks": {"type": "text"},
-                        "MaxMemoryUsed": {"type": "float"},
-                        "MemorySize": {"type": "float"},
-                        "LogType": {"type": "text"},
-                        "RequestId": {"type": "text"},
-                        "timestamp": {
-                            "type": "date",
-                            "format": "epoch_millis"
-                        }
+_es = None
+_known_indexes = set()
+logger = logging.getLogger(__name__)
+
+def get_es():
+    """Create the ES client (signing AWS credentials) on first use and re-use it for the lifetime of the container"""
+    global _es
+    if _es is None:
+        cred = boto3.Session().get_credentials()
+        awsauth = AWS4Auth(cred.access_key, cred.secret_key, REGION, 'es', session_token=cred.token)
+        _es = Elasticsearch(
+            hosts=[{'host': ES_HOST, 'port': 443}],
+            http_auth=awsauth,
+            use_ssl=True,
+            verify_certs=True,
+            connection_class=RequestsHttpConnection
+        )
+    return _es
+
+def index_template():
+    """Template applied to every daily log index, so new indexes get the log mapping when they are first written to"""
+    return {
+        "index_patterns": [INDEX_PREFIX + "*"],
+        "mappings": {
+            "log": {
+                "properties": {
+                    "id": {"type": "text"},
+                    "AddDuration": {"type": "float"},
+                    "BilledDuration": {"type": "float"},
+                    "BytesRead": {"type": "long"},
+                    "BytesWritten": {"type": "long"},
+                    "CacheHits": {"type": "integer"},
+                    "CacheMisses": {"type": "integer"},
+                    "CollectionName": {"type": "text"},
+                    "DuplicateCount": {"type": "integer"},
+                    "Duration": {"type": "float"},
+                    "InitDuration": {"type": "float"},
+                    "ItemCount": {"type": "integer"},
+                    "ItemLinks": {"type": "text"},
+                    "MaxMemoryUsed": {"type": "float"},
+                    "MemorySize": {"type": "float"},
+                    "LogType": {"type": "text"},
+                    "OpenDuration": {"type": "float"},
+                    "PublishDuration": {"type": "float"},
+                    "RequestId": {"type": "text"},
+                    "S3Gets": {"type": "integer"},
+                    "S3Puts": {"type": "integer"},
+                    "SaveDuration": {"type": "float"},
+                    "timestamp": {
+                        "type": "date",
+                        "format": "epoch_millis"
+                    }
+                }
+            }
+        }
+    }
+
+def rollup_template():
+    """Mapping of the rollup index, the duration sketch is only stored (its keys are not indexed)"""
+    return {
+        "index_patterns": [ROLLUP_INDEX],
+        "mappings": {
+            "log": {
+                "properties": {
+                    "CollectionName": {"type": "keyword"},
+                    "DurationMax": {"type": "float"},
+                    "DurationP95": {"type": "float"},
+                    "DurationSketch": {"type": "object", "enabled": False},
+                    "DurationSum": {"type": "float"},
+                    "Interval": {"type": "keyword"},
+                    "Invocations": {"type": "long"},
+                    "ItemCount": {"type": "long"},
+                    "timestamp": {
+                        "type": "date",
+                        "format": "epoch_millis"
                     }
                 }
             }
         }
+    }
+
+# Painless version of ``merge_rollup``, run by ES so concurrent invocations can update the same rollup.
+ROLLUP_SOURCE = """
+def s = ctx._source;
+s.ItemCount += params.ItemCount;
+s.Invocations += params.Invocations;
+s.DurationSum += params.DurationSum;
+s.DurationMax = Math.max(s.DurationMax, params.DurationMax);
+for (def e : params.DurationSketch.entrySet()) {
+  s.DurationSketch[e.getKey()] = s.DurationSketch.getOrDefault(e.getKey(), 0) + e.getValue();
+}
+def keys = new ArrayList(s.DurationSketch.keySet());
+keys.sort((a, b) -> Integer.compare(Integer.parseInt(a), Integer.parseInt(b)));
+double rank = Math.ceil(params.quantile * s.Invocations);
+long seen = 0;
+for (def k : keys) {
+  seen += s.DurationSketch[k];
+  if (seen >= rank) {
+    s.DurationP95 = 2 * Math.pow(params.gamma, Integer.parseInt(k)) / (params.gamma + 1);
+    break;
+  }
+}
+"""
+
+def create_index(index_name):
+    """
+    Make sure the ES index with given name will use the log mapping.  The index templates and the rollup script are
+    installed once per container and indexes are remembered, so ES is not queried on every invocation (the bulk request
+    creates the index if it doesn't exist yet).
+    """
+    if index_name in _known_indexes:
+        return
+    if not _known_indexes:
+        es = get_es()
+        es.indices.put_template(name=TEMPLATE_NAME, body=index_template())
+        es.indices.put_template(name=ROLLUP_INDEX, body=rollup_template())
+        es.put_script(id=ROLLUP_SCRIPT, body={'script': {'lang': 'painless', 'source': ROLLUP_SOURCE}})
+    _known_indexes.add(index_name)
+
+def index_name(timestamp):
+    """Name of the daily index of a log event (timestamp in epoch millis)"""
+    log_date = datetime.fromtimestamp(int(str(timestamp)[:-3]))
+    return INDEX_PREFIX + log_date.strftime("%Y%m%d")
+
+# `Key: value` pairs of a tab-separated log line, keys may contain spaces (ex. `Billed Duration: 500 ms`).
+FIELD = re.compile(r'([^\t:]+): ([^\t]*)')
+LEGACY_LINK = re.compile(r"'([^']*)'")
+
+def parse_number(value):
+    """Parse a number with an optional unit (ex. `442.49 ms`)"""
+    return float(value.split(' ', 1)[0])
 
-        es.indices.create(index_name, body=mapping)
+def parse_links(value):
+    """Parse the JSON list of item links (older LOGS lines used a python list repr)"""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return LEGACY_LINK.findall(value)
+
+# Fields of the LOGS and REPORT lines which aren't strings.
+FIELD_TYPES = {
+    'AddDuration': parse_number,
+    'BilledDuration': parse_number,
+    'BytesRead': int,
+    'BytesWritten': int,
+    'CacheHits': int,
+    'CacheMisses': int,
+    'DuplicateCount': int,
+    'Duration': parse_number,
+    'InitDuration': parse_number,
+    'ItemCount': int,
+    'ItemLinks': parse_links,
+    'MaxMemoryUsed': parse_number,
+    'MemorySize': parse_number,
+    'OpenDuration': parse_number,
+    'PublishDuration': parse_number,
+    'S3Gets': int,
+    'S3Puts': int,
+    'SaveDuration': parse_number,
+}
+
+def log_type(log):
+    return log['message'].split(' ', 1)[0]
 
 def transform_log(log):
-    """Transform logs into schema which matches ES index (see create_index)."""
+    """Transform logs into schema which matches ES index (see index_template)."""
     log['id'] = int(str(log['id'])[:11])
     message = log.pop('message')
-    splits = message.rstrip().split('\t')
-    log_type = splits[0].split(' ')[0]
-    splits[0] = splits[0].replace(log_type + ' ', '')
-
-    for item in splits:
-        k, v = item.split(': ')
-        if k == 'ItemLinks':
-            v = v.split('"')
-            if len(v) == 1:
-                v = v[0]
-            else:
-                v = '[' + ",".join(v) + ']'
-        else:
-            v = v.split(' ')[0]
-        k = k.replace(' ','')
-        log.update({k:v})
+    for k, v in FIELD.findall(message.rstrip().split(' ', 1)[1]):
+        k = k.replace(' ', '')
+        if k in FIELD_TYPES:
+            v = FIELD_TYPES[k](v)
+        log[k] = v
 
 def transform_logs(first_log, second_log=None):
     """Identify input logs as LOGS or REPORT and build ES document (combining if both logs are passsed)."""
-    log_type = first_log['message'].rstrip().split('\t')[0].split(' ')[0]
+    first_type = log_type(first_log)
 
     event_report = event_log = None
-    if log_type == 'LOGS':
+    if first_type == 'LOGS':
         event_log = first_log
         if second_log:
             event_report = second_log
-    elif log_type == 'REPORT':
+    elif first_type == 'REPORT':
         event_report = first_log
         if second_log:
             event_log = second_log
 
     if event_log:
         transform_log(event_log)
-        print("event log",event_log)
-        event_log['ItemLinks'] = ast.literal_eval(event_log['ItemLinks'])
+        logger.debug("event log %s", event_log)
     if event_report:
         transform_log(event_report)
-        print("event report", event_report)
+        logger.debug("event report %s", event_report)
     if event_log and event_report:
         # Prioritize keys from event_report if duplicated.
         combined_logs = {**event_log, **event_report}
@@ -101,57 +228,102 @@ def transform_logs(first_log, second_log=None):
         if event_report:
             return event_report
 
-def es_index(body, index_name, safe=False):
-    """Insert item into ES with safe mode"""
-    kwargs = {
-        'id': body['id'],
-        'body': body,
-        'index': index_name,
-        'doc_type': 'log',
-    }
+def sketch_key(duration):
+    """Bucket of a duration (ms) in the duration sketch"""
+    return str(math.ceil(math.log(max(duration, 1.0), SKETCH_GAMMA)))
 
-    if safe:
-        print("Using safe index.")
-        kwargs.update({'op_type': 'create'})
+def merge_rollup(rollup, params):
+    """Add the invocations summarized by ``params`` to a rollup document (same as ROLLUP_SOURCE)"""
+    for k in ('ItemCount', 'Invocations', 'DurationSum'):
+        rollup[k] = rollup.get(k, 0) + params[k]
+    rollup['DurationMax'] = max(rollup.get('DurationMax', 0), params['DurationMax'])
+    sketch = rollup.setdefault('DurationSketch', {})
+    for k, v in params['DurationSketch'].items():
+        sketch[k] = sketch.get(k, 0) + v
 
-    try:
-        resp = es.index(**kwargs)
-        return resp
-    except ConflictError:
-        del(kwargs['op_type'])
-        # ID already exists, use update instead.
-        kwargs['body'] = {'doc': kwargs['body']}
-        resp = es.update(**kwargs)
-        return resp
+    rank = math.ceil(params['quantile'] * rollup['Invocations'])
+    seen = 0
+    for k in sorted(sketch, key=int):
+        seen += sketch[k]
+        if seen >= rank:
+            rollup['DurationP95'] = 2 * params['gamma'] ** int(k) / (params['gamma'] + 1)
+            break
+    return rollup
+
+def is_complete(doc):
+    """True if a log document has both its LOGS and REPORT fields"""
+    return 'CollectionName' in doc and 'Duration' in doc
+
+def rollup_actions(docs):
+    """Bulk actions adding complete log documents to the rollups of their collection, one action per rollup"""
+    rollups = {}
+    for doc in docs:
+        for interval, size in ROLLUP_INTERVALS.items():
+            start = int(doc['timestamp']) // size * size
+            params = rollups.setdefault(f"{doc['CollectionName']}:{interval}:{start}", {
+                'CollectionName': doc['CollectionName'], 'Interval': interval, 'timestamp': start,
+                'ItemCount': 0, 'Invocations': 0, 'DurationSum': 0, 'DurationMax': 0, 'DurationSketch': {},
+                'gamma': SKETCH_GAMMA, 'quantile': ROLLUP_QUANTILE
+            })
+            params['ItemCount'] += doc.get('ItemCount', 0)
+            params['Invocations'] += 1
+            params['DurationSum'] += doc['Duration']
+            params['DurationMax'] = max(params['DurationMax'], doc['Duration'])
+            key = sketch_key(doc['Duration'])
+            params['DurationSketch'][key] = params['DurationSketch'].get(key, 0) + 1
+
+    body = []
+    for rollup_id, params in rollups.items():
+        upsert = merge_rollup({k: params[k] for k in ('CollectionName', 'Interval', 'timestamp')}, params)
+        body.append({'update': {'_index': ROLLUP_INDEX, '_type': 'log', '_id': rollup_id, 'retry_on_conflict': 5}})
+        body.append({'script': {'id': ROLLUP_SCRIPT, 'params': params}, 'upsert': upsert})
+    return body
+
+def bulk_index(docs):
+    """
+    Index documents with a single bulk request, routing each document to the daily index of its timestamp.  Each
+    document is created, or merged into the existing document with the same ID (the other half of a LOGS/REPORT pair
+    indexed by another invocation).  Complete documents are added to the rollups in the same request; documents only
+    completed by that merge are rolled up with a second request, by the invocation which completed them.  Returns
+    per-item errors.
+    """
+    body = []
+    for doc in docs:
+        name = index_name(doc['timestamp'])
+        create_index(name)
+        body.append({'update': {'_index': name, '_type': 'log', '_id': doc['id'], 'retry_on_conflict': 3}})
+        # The merged document is returned, to find out whether this half completed it.
+        body.append({'doc': doc, 'doc_as_upsert': True, '_source': True})
+    body.extend(rollup_actions([doc for doc in docs if is_complete(doc)]))
+
+    resp = get_es().bulk(body=body)
+    items = resp['items']
+    merged = [x['update'].get('get', {}).get('_source', {}) for x in items[:len(docs)]]
+    completed = [x for doc, x in zip(docs, merged) if not is_complete(doc) and is_complete(x)]
+    if completed:
+        items = items + get_es().bulk(body=rollup_actions(completed))['items']
+
+    errors = [x['update'] for x in items if 'error' in x['update']]
+    for error in errors:
+        print(f"Failed to index log {error['_id']}: {error['error']}")
+    return errors
+
+def group_logs(log_events):
+    """Group the LOGS and REPORT events of each invocation in a single pass."""
+    groups = {}
+    for log in log_events:
+        # Only the first 11 characters of the id are unique across logs from the same invocation.
+        groups.setdefault(str(log['id'])[:11], []).append(log)
+    return list(groups.values())
 
 def index_logs(cwl_data):
     # Cloudwatch receives two types of logs (LOGS and REPORT) from the updateCollection lambda -- see cloudwatch filters.
     # LOGS contains information about lambda function payload (catalog name, batch size etc., stac item url)
     # REPORT contains information about lambda runtime (memory used, billed time etc.)
     # There is no guarantee that both logs from an individual lambda will be processed during the same invocation.
-    log_count = len(cwl_data['logEvents'])
-
-    # Making the assumption that all logs processed by a single invocation happen on the same calendar day.
-    # Creating a new index each day.
-    log_date = datetime.fromtimestamp(int(str(cwl_data['logEvents'][0]['timestamp'])[:-3]))
-    index_name = 'stac_updater_logs_' + log_date.strftime("%Y%m%d")
-    create_index(index_name)
+    # A new index is created each day, logs processed by a single invocation may span several days.
 
-    # If there are multiple messages, first try matching the LOGS and REPORT values across messages (via ID).
-    # This saves having to check if the ID already exists in elasticsearch.
-    if log_count > 1:
-        # Only the first 11 characters of the id are unique across logs from the same invocation.
-        ids = [x['id'] for x in cwl_data['logEvents']]
-        unique_ids = set(ids)
-        matches = [[i for i, x in enumerate(ids) if x==id] for id in unique_ids]
-        for pair in matches:
-            # The other log is being proceed by a different invocation
-            if len(pair) == 1:
-                some_log = transform_logs(cwl_data['logEvents'][pair[0]])
-                es_index(some_log, index_name, safe=True)
-            else:
-                combined_logs = transform_logs(cwl_data['logEvents'][pair[0]], cwl_data['logEvents'][pair[1]])
-                es_index(combined_logs, index_name, safe=True)
-    else:
-        some_log = transform_logs(cwl_data['logEvents'][0])
-        es_index(some_log, index_name, safe=True)
\ No newline at end of file
+    # First match the LOGS and REPORT values across messages (via ID), logs whose pair is being processed by a
+    # different invocation are merged into the same document by the bulk upsert.
+    docs = [transform_logs(*group[:2]) for group in group_logs(cwl_data['logEvents'])]
+    return bulk_index(docs)
@@ -85,7 +85,7 @@ def subscribe_lambda_to_sns(lambda_arn, topic_name):
     return subscription, lambda_policy
 
 
-def sqs_queue(queue_name, dlq_name=None, maxRetry=3, long_poll=False):
+def sqs_queue(queue_name, dlq_name=None, maxRetry=3, long_poll=False, fifo=False):
     resource = {
         "Type": "AWS::SQS::Queue",
         "Properties": {
@@ -93,6 +93,14 @@ def sqs_queue(queue_name, dlq_name=None, maxRetry=3, long_poll=False):
         }
     }
 
+    if fifo:
+        # The names of FIFO queues must end with `.fifo`.
+        resource['Properties'].update({
+            'QueueName': f"{queue_name}.fifo",
+            'FifoQueue': True,
+            'ContentBasedDeduplication': True
+        })
+
     if dlq_name:
         redrive_policy = {
             "deadLetterTargetArn": {
@@ -110,6 +118,26 @@ def sqs_queue(queue_name, dlq_name=None, maxRetry=3, long_poll=False):
 
     return resource
 
+def claim_check_bucket(bucket_name, expiration_days=7):
+    # Claims are only needed until their item is ingested.
+    resource = {
+        "Type": "AWS::S3::Bucket",
+        "Properties": {
+            "BucketName": bucket_name,
+            "LifecycleConfiguration": {
+                "Rules": [
+                    {
+                        "Id": "expire-claims",
+                        "Prefix": "claims/",
+                        "Status": "Enabled",
+                        "ExpirationInDays": expiration_days
+                    }
+                ]
+            }
+        }
+    }
+    return resource
+
 def sns_topic(topic_name):
     resource = {
         "Type": "AWS::SNS::Topic",
@@ -131,6 +159,8 @@ def lambda_sqs_trigger(func_name, queue_name, catalog_root, concurrency):
                     "arn": "arn:aws:sqs:#{}:#{}:{}".format("{AWS::Region}",
                                                         "{AWS::AccountId}",
                                                         queue_name),
+                    # Only retry the messages reported in `batchItemFailures`.
+                    "functionResponseType": "ReportBatchItemFailures"
                 }
             }
         ],
@@ -139,6 +169,24 @@ def lambda_sqs_trigger(func_name, queue_name, catalog_root, concurrency):
 
     return func
 
+def lambda_schedule_trigger(func_name, catalog_root, schedule):
+    func = {
+        "handler": f"stac_updater.handler.{func_name}",
+        "environment": {
+            'COLLECTION_ROOT': catalog_root
+        },
+        "events": [
+            {
+                "schedule": schedule
+            }
+        ],
+        "timeout": 300,
+        # The compactor is the only writer of the collection's catalogs.
+        "reservedConcurrency": 1
+    }
+
+    return func
+
 def lambda_s3_trigger(func_name, bucket_name):
     func = {
         "handler": f"stac_updater.handler.{func_name}",
@@ -195,27 +243,56 @@ def lambda_invoke(func_name):
     }
     return func
 
-def update_collection(name, root, filter_rule, long_poll, concurrency, path, filename):
+def update_collection(name, root, filter_rule, long_poll, concurrency, path, filename, deduplicate=False,
+                      fifo=False, page_size=None, direct=False, journal=None):
     dlq_name = f"{name}Dlq"
     queue_name = f"{name}Queue"
     sns_sub_name = f"{name}SnsSub"
     sqs_policy_name = f"{name}SqsPolicy"
     lambda_name = "update_collection"
 
-    dlq = sqs_queue(dlq_name)
-    queue = sqs_queue(queue_name, dlq_name=dlq_name, maxRetry=3, long_poll=long_poll)
-    sns_subscription, sqs_policy = subscribe_sqs_to_sns(queue_name, 'newStacItemTopic', filter_rule)
-    lambda_updater = lambda_sqs_trigger(lambda_name, queue_name, root, concurrency)
+    dlq = sqs_queue(dlq_name, fifo=fifo)
+    queue = sqs_queue(queue_name, dlq_name=dlq_name, maxRetry=3, long_poll=long_poll, fifo=fifo)
 
-    if path:
-        lambda_updater['environment'].update({
-            'PATH': path
-        })
+    functions = {}
+    if journal:
+        # Catalogs are only updated by the compactor, on the `journal` schedule (ex. `rate(5 minutes)`).
+        compactor = lambda_schedule_trigger("compact_collection", root, journal)
+        functions[f"{name}_compact_collection"] = _updater_environment(compactor, None, None, False, page_size)
 
-    if filename:
+    if fifo or direct:
+        # Kickoff sends the collection's items to the queue itself, compiled from the filter rule into its routing
+        # table (SNS standard topics can't deliver to FIFO queues).
+        routed_queue = queue['Properties']['QueueName']
+        lambda_updater = lambda_sqs_trigger(lambda_name, routed_queue, root, concurrency)
+        if fifo:
+            lambda_updater['environment'].update({
+                'FIFO_QUEUE': routed_queue
+            })
+        if journal:
+            lambda_updater['environment'].update({
+                'JOURNAL': 'true'
+            })
+        functions[f"{name}_{lambda_name}"] = _updater_environment(lambda_updater, path, filename, deduplicate,
+                                                                  page_size)
+        return {
+            'resources': {
+                dlq_name: dlq,
+                queue_name: queue
+            },
+            'functions': functions,
+            'queue_routes': {
+                collection: {'queue': routed_queue, 'path': path or ''} for collection in filter_rule['collection']
+            }
+        }
+
+    sns_subscription, sqs_policy = subscribe_sqs_to_sns(queue_name, 'newStacItemTopic', filter_rule)
+    lambda_updater = lambda_sqs_trigger(lambda_name, queue_name, root, concurrency)
+    if journal:
         lambda_updater['environment'].update({
-            'FILENAME': filename
+            'JOURNAL': 'true'
         })
+    functions[f"{name}_{lambda_name}"] = _updater_environment(lambda_updater, path, filename, deduplicate, page_size)
 
     return {
         'resources': {
@@ -224,7 +301,29 @@ def update_collection(name, root, filter_rule, long_poll, concurrency, path, fil
             sns_sub_name: sns_subscription,
             sqs_policy_name: sqs_policy
         },
-        'functions': {
-            f"{name}_{lambda_name}": lambda_updater
-        }
+        'functions': functions
     }
+
+def _updater_environment(lambda_updater, path, filename, deduplicate, page_size):
+
+    if path:
+        lambda_updater['environment'].update({
+            'PATH': path
+        })
+
+    if filename:
+        lambda_updater['environment'].update({
+            'FILENAME': filename
+        })
+
+    if deduplicate:
+        lambda_updater['environment'].update({
+            'DEDUPLICATE': 'true'
+        })
+
+    if page_size:
+        lambda_updater['environment'].update({
+            'CATALOG_PAGE_SIZE': str(page_size)
+        })
+
+    return lambda_updater
@@ -0,0 +1,188 @@
+"""
+Spatial matching of STAC Items against the areas of interest of notification subscribers.  Subscriber geometries are
+indexed with an STR-packed R-tree (built once and queried with each item's bbox), and candidates are confirmed with an
+exact intersection test of the GeoJSON geometries.  Coordinates are planar lon/lat: geometries crossing the
+antimeridian must be split.
+"""
+import math
+
+
+def _parts(geometry):
+    """(polygons, lines, points) of a GeoJSON geometry, polygons as lists of rings"""
+    kind = geometry['type']
+    coords = geometry.get('coordinates')
+    if kind == 'Polygon':
+        return [coords], [], []
+    elif kind == 'MultiPolygon':
+        return list(coords), [], []
+    elif kind == 'LineString':
+        return [], [coords], []
+    elif kind == 'MultiLineString':
+        return [], list(coords), []
+    elif kind == 'Point':
+        return [], [], [coords]
+    elif kind == 'MultiPoint':
+        return [], [], list(coords)
+    elif kind == 'GeometryCollection':
+        polygons, lines, points = [], [], []
+        for part in geometry['geometries']:
+            p, l, pt = _parts(part)
+            polygons += p
+            lines += l
+            points += pt
+        return polygons, lines, points
+    raise ValueError(f"Unsupported geometry type {kind}")
+
+
+def bbox_polygon(bbox):
+    xmin, ymin, xmax, ymax = bbox[0], bbox[1], bbox[-2], bbox[-1]
+    return {'type': 'Polygon', 'coordinates': [[[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]]}
+
+
+class Shape(object):
+    """GeoJSON geometry prepared for intersection tests"""
+
+    def __init__(self, geometry):
+        self.polygons, lines, self.points = _parts(geometry)
+        # Every boundary (rings of the polygons and lines) as a list of segments.
+        self.segments = [(a[:2], b[:2]) for line in [ring for rings in self.polygons for ring in rings] + lines
+                         for a, b in zip(line, line[1:])]
+        # A vertex of each part, to test containment when no boundaries cross.
+        self.vertices = [rings[0][0] for rings in self.polygons if rings and rings[0]] + \
+                        [line[0] for line in lines if line] + self.points
+        coords = [x for segment in self.segments for x in segment] + self.points
+        if not coords:
+            raise ValueError("Empty geometry")
+        self.bounds = (min(x[0] for x in coords), min(x[1] for x in coords),
+                       max(x[0] for x in coords), max(x[1] for x in coords))
+
+    def contains_point(self, point):
+        """True if a point is inside (or on the boundary of) one of the polygons, holes excluded"""
+        x, y = point[0], point[1]
+        for rings in self.polygons:
+            inside = False
+            for ring in rings:
+                for a, b in zip(ring, ring[1:]):
+                    if _on_segment(a, b, point):
+                        return True
+                    if (a[1] > y) != (b[1] > y) and x < (b[0] - a[0]) * (y - a[1]) / (b[1] - a[1]) + a[0]:
+                        inside = not inside
+            if inside:
+                return True
+        return False
+
+    def intersects(self, other):
+        if not _overlaps(self.bounds, other.bounds):
+            return False
+        for a, b in self.segments:
+            for c, d in other.segments:
+                if _segments_intersect(a, b, c, d):
+                    return True
+        if any(other.contains_point(x) for x in self.vertices) or any(self.contains_point(x) for x in other.vertices):
+            return True
+        # Points which are on a line or equal to another point.
+        return any(_on_segment(c, d, x) for x in self.points for c, d in other.segments) or \
+            any(_on_segment(a, b, x) for x in other.points for a, b in self.segments) or \
+            any(x[:2] == y[:2] for x in self.points for y in other.points)
+
+
+def _overlaps(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _orientation(a, b, c):
+    value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    return (value > 0) - (value < 0)
+
+
+def _on_segment(a, b, p):
+    return _orientation(a, b, p) == 0 and min(a[0], b[0]) <= p[0] <= max(a[0], b[0]) and \
+        min(a[1], b[1]) <= p[1] <= max(a[1], b[1])
+
+
+def _segments_intersect(a, b, c, d):
+    o1, o2, o3, o4 = _orientation(a, b, c), _orientation(a, b, d), _orientation(c, d, a), _orientation(c, d, b)
+    if o1 != o2 and o3 != o4:
+        return True
+    return (o1 == 0 and _on_segment(a, b, c)) or (o2 == 0 and _on_segment(a, b, d)) or \
+        (o3 == 0 and _on_segment(c, d, a)) or (o4 == 0 and _on_segment(c, d, b))
+
+
+class STRtree(object):
+    """Static R-tree of (bounds, value) entries, packed with Sort-Tile-Recursive so its nodes barely overlap"""
+
+    def __init__(self, entries, capacity=16):
+        self.capacity = capacity
+        self.height = 0
+        nodes = list(entries)
+        while len(nodes) > capacity:
+            nodes = self._pack(nodes)
+            self.height += 1
+        self.root = nodes
+
+    def _pack(self, nodes):
+        """Group nodes into parents of ``capacity`` children: sort by x into vertical slices, then each slice by y"""
+        parents = int(math.ceil(len(nodes) / self.capacity))
+        per_slice = int(math.ceil(math.sqrt(parents))) * self.capacity
+        nodes = sorted(nodes, key=lambda x: x[0][0] + x[0][2])
+        packed = []
+        for i in range(0, len(nodes), per_slice):
+            column = sorted(nodes[i:i + per_slice], key=lambda x: x[0][1] + x[0][3])
+            for j in range(0, len(column), self.capacity):
+                children = column[j:j + self.capacity]
+                bounds = (min(x[0][0] for x in children), min(x[0][1] for x in children),
+                          max(x[0][2] for x in children), max(x[0][3] for x in children))
+                packed.append((bounds, children))
+        return packed
+
+    def query(self, bounds):
+        """Values whose bounds overlap ``bounds`` (xmin, ymin, xmax, ymax)"""
+        values = []
+        stack = [(self.root, self.height)]
+        while stack:
+            nodes, level = stack.pop()
+            for node_bounds, child in nodes:
+                if _overlaps(node_bounds, bounds):
+                    if level:
+                        stack.append((child, level - 1))
+                    else:
+                        values.append(child)
+        return values
+
+
+class SubscriptionIndex(object):
+    """
+    Subscriptions of a registry, each with an ``id``, a destination (``topic`` ARN or ``queue`` URL), an area of
+    interest (GeoJSON ``geometry`` or ``bbox``) and optionally the ``collections`` it is limited to.
+    """
+
+    def __init__(self, subscriptions):
+        """Index every subscription, raising ValueError if one of them has no destination or area of interest"""
+        entries = []
+        for subscription in subscriptions:
+            name = subscription.get('id', subscription)
+            if not subscription.get('topic') and not subscription.get('queue'):
+                raise ValueError(f"Subscription {name} has no topic or queue")
+            if not subscription.get('geometry') and not subscription.get('bbox'):
+                raise ValueError(f"Subscription {name} has no geometry or bbox")
+            try:
+                shape = Shape(subscription.get('geometry') or bbox_polygon(subscription['bbox']))
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                raise ValueError(f"Subscription {name} has an invalid area of interest: {type(e).__name__}: {e}")
+            entries.append((shape.bounds, (shape, subscription)))
+        self.tree = STRtree(entries)
+        self.size = len(entries)
+
+    def match(self, item):
+        """
+        Subscriptions whose area of interest intersects the footprint of a STAC Item (its geometry, or bbox).  Raises
+        ValueError if the item has no valid footprint.
+        """
+        try:
+            shape = Shape(item.get('geometry') or bbox_polygon(item['bbox']))
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            raise ValueError(f"Item {item.get('id')} has no valid geometry or bbox: {type(e).__name__}: {e}")
+        collection = item.get('collection') or item.get('properties', {}).get('collection')
+        return [subscription for candidate, subscription in self.tree.query(shape.bounds)
+                if (not subscription.get('collections') or collection in subscription['collections'])
+                and candidate.intersects(shape)]
@@ -0,0 +1,234 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import threading
+
+import requests
+from satstac import STACError
+from satstac.utils import get_s3_signed_url, mkdirp
+
+from stac_updater.utils import dumps, loads
+
+# Parsed catalogs are cached for the lifetime of the (warm) container and revalidated on every read with a
+# conditional GET (or file mtime for local catalogs).  Entries evicted from memory may spill to disk (ex. /tmp).
+CACHE_SIZE = int(os.getenv('CATALOG_CACHE_SIZE', 256))
+CACHE_DIR = os.getenv('CATALOG_CACHE_DIR')
+# Number of objects written concurrently by ``write_many``.
+WRITE_CONCURRENCY = int(os.getenv('WRITE_CONCURRENCY', 8))
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+_stats_lock = threading.Lock()
+# Per-invocation counters of cache hits/misses, of read (GET) and write (PUT) requests and of the bytes transferred.
+STATS = {'hits': 0, 'misses': 0, 'gets': 0, 'puts': 0, 'bytes_read': 0, 'bytes_written': 0}
+
+
+def reset_stats():
+    """Reset per-invocation counters"""
+    STATS.update({k: 0 for k in STATS})
+
+
+def _copy(data):
+    """
+    Copy a cached object deep enough that callers may add/remove links (or other entries of top-level lists and
+    dictionaries) without touching the cached version
+    """
+    data = dict(data)
+    for k, v in data.items():
+        if isinstance(v, list):
+            data[k] = [dict(x) if isinstance(x, dict) else x for x in v]
+        elif isinstance(v, dict):
+            data[k] = dict(v)
+    return data
+
+
+def _disk_path(url):
+    return os.path.join(CACHE_DIR, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+
+def _cache_get(url):
+    """Lookup (validator, data) of a catalog, promoting disk entries into memory"""
+    if url in _cache:
+        _cache.move_to_end(url)
+        return _cache[url]
+    if CACHE_DIR:
+        try:
+            with open(_disk_path(url), 'r') as f:
+                entry = json.load(f)
+            _cache_put(url, entry['etag'], entry['data'], persist=False)
+            return _cache[url]
+        except (OSError, ValueError, KeyError):
+            pass
+    return None
+
+
+def _cache_put(url, etag, data, persist=True):
+    with _cache_lock:
+        _cache[url] = (etag, _copy(data))
+        _cache.move_to_end(url)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+        if CACHE_DIR and persist:
+            mkdirp(CACHE_DIR)
+            with open(_disk_path(url), 'w') as f:
+                json.dump({'url': url, 'etag': etag, 'data': data}, f)
+            _evict_disk()
+
+
+def _evict_disk():
+    """Keep at most CACHE_SIZE catalogs on disk, removing the least recently written"""
+    files = [os.path.join(CACHE_DIR, x) for x in os.listdir(CACHE_DIR)]
+    if len(files) > CACHE_SIZE:
+        files.sort(key=os.path.getmtime)
+        for fname in files[:len(files) - CACHE_SIZE]:
+            os.remove(fname)
+
+
+def _get(url, headers):
+    """GET a remote file, falling back to a signed S3 request (see ``Thing.open``)"""
+    resp = requests.get(url, headers=headers)
+    if resp.status_code not in (200, 304):
+        signed_url, signed_headers = get_s3_signed_url(url)
+        resp = requests.get(signed_url, headers={**(signed_headers or {}), **headers})
+    return resp
+
+
+def read_json(url, cache=True):
+    """Read a catalog, serving it from the cache when it is unchanged since it was last read or written"""
+    entry = _cache_get(url) if cache else None
+    STATS['gets'] += 1
+
+    if url[0:5] == 'https':
+        headers = {'If-None-Match': entry[0]} if entry else {}
+        resp = _get(url, headers)
+        if resp.status_code == 304 and entry:
+            STATS['hits'] += 1
+            return _copy(entry[1])
+        elif resp.status_code != 200:
+            raise STACError('Unable to open %s' % url)
+        STATS['bytes_read'] += len(resp.content)
+        data = loads(resp.text)
+        etag = resp.headers.get('ETag')
+    else:
+        if not os.path.exists(url):
+            raise STACError('%s does not exist locally' % url)
+        etag = str(os.stat(url).st_mtime_ns)
+        if entry and entry[0] == etag:
+            STATS['hits'] += 1
+            return _copy(entry[1])
+        with open(url, 'r') as f:
+            body = f.read()
+        STATS['bytes_read'] += len(body)
+        data = loads(body)
+
+    STATS['misses'] += 1
+    if cache and etag:
+        _cache_put(url, etag, data)
+    return data
+
+
+def write_json(url, data, cache=True):
+    """Write a catalog (or item), keeping the cache up to date with the new version"""
+    body = dumps(data)
+    with _stats_lock:
+        STATS['puts'] += 1
+        STATS['bytes_written'] += len(body)
+
+    if url[0:5] == 'https':
+        signed_url, signed_headers = get_s3_signed_url(url, rtype='PUT', public=True, content_type='application/json')
+        resp = requests.put(signed_url, data=body, headers=signed_headers)
+        if resp.status_code != 200:
+            raise STACError('Unable to save file to %s: %s' % (url, resp.text))
+        etag = resp.headers.get('ETag')
+    else:
+        # Several objects may be written to the same new directory concurrently.
+        os.makedirs(os.path.dirname(url), exist_ok=True)
+        with open(url, 'w') as f:
+            f.write(body)
+        etag = str(os.stat(url).st_mtime_ns)
+
+    if cache and etag:
+        _cache_put(url, etag, data)
+
+
+def _s3_location(url):
+    """(bucket, key) of a S3 https URL (``https://<bucket>.s3.amazonaws.com/<key>``, see ``get_s3_signed_url``)"""
+    parts = url.replace('https://', '').split('/')
+    return parts[0].replace('.s3.amazonaws.com', ''), '/'.join(parts[1:])
+
+
+def _s3_client():
+    import boto3
+    return boto3.client('s3')
+
+
+def list_objects(prefix):
+    """URLs of the objects under a prefix (a local directory or S3 https URL), in lexicographic order"""
+    prefix = prefix.rstrip('/')
+    if prefix[0:5] == 'https':
+        bucket, key = _s3_location(prefix + '/')
+        pages = _s3_client().get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=key)
+        base = prefix[:len(prefix) - len(key) + 1].rstrip('/')
+        return [f"{base}/{x['Key']}" for page in pages for x in page.get('Contents', [])]
+    if not os.path.isdir(prefix):
+        return []
+    return [os.path.join(prefix, x) for x in sorted(os.listdir(prefix))]
+
+
+def delete_many(urls):
+    """Delete objects (local or S3 https URLs), returning the URLs which failed to be deleted"""
+    failed = []
+    remote = {}
+    for url in urls:
+        if url[0:5] == 'https':
+            bucket, key = _s3_location(url)
+            remote.setdefault(bucket, []).append((url, key))
+            continue
+        try:
+            os.remove(url)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Failed to delete {url}: {e}")
+            failed.append(url)
+
+    for bucket, objects in remote.items():
+        # DeleteObjects takes up to 1000 keys.
+        for i in range(0, len(objects), 1000):
+            chunk = dict((key, url) for url, key in objects[i:i + 1000])
+            try:
+                resp = _s3_client().delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': k} for k in chunk]})
+                errors = resp.get('Errors', [])
+            except Exception as e:
+                errors = [{'Key': k, 'Message': str(e)} for k in chunk]
+            for error in errors:
+                print(f"Failed to delete {chunk[error['Key']]}: {error.get('Message')}")
+                failed.append(chunk[error['Key']])
+    return failed
+
+
+def write_many(objects, cache=True):
+    """
+    Concurrently write independent objects, given as (url, data) pairs.  Returns once every write has finished, with
+    a dictionary of {url: exception} of the writes which failed.
+    """
+    errors = {}
+    if len(objects) <= 1 or WRITE_CONCURRENCY <= 1:
+        for url, data in objects:
+            try:
+                write_json(url, data, cache=cache)
+            except Exception as e:
+                errors[url] = e
+    else:
+        with ThreadPoolExecutor(max_workers=min(WRITE_CONCURRENCY, len(objects))) as executor:
+            futures = {url: executor.submit(write_json, url, data, cache) for url, data in objects}
+        for url, future in futures.items():
+            if future.exception() is not None:
+                errors[url] = future.exception()
+
+    for url, e in errors.items():
+        print(f"Failed to write {url}: {e}")
+    return errors
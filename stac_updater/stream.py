@@ -0,0 +1,180 @@
+import codecs
+import gzip
+import json
+
+CHUNK_SIZE = 64 * 1024
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl', '.geojsonl', '.ndgeojson')
+
+# Formats of a (decompressed) bulk file.  ``ndjson`` is one STAC Item per line, ``json`` is either a single STAC
+# Item or a FeatureCollection/ItemCollection, and ``features`` is the inside of a ``features`` array (used to resume
+# reading a FeatureCollection from a byte offset).
+NDJSON = 'ndjson'
+JSON = 'json'
+FEATURES = 'features'
+
+
+def is_gzipped(key):
+    return key.endswith('.gz')
+
+
+def detect_format(key):
+    """Guess the format of a bulk file from its key"""
+    if is_gzipped(key):
+        key = key[:-3]
+    return NDJSON if key.endswith(NDJSON_EXTENSIONS) else JSON
+
+
+def open_stream(body, key, offset=0):
+    """
+    Wrap a file-like object (ex. S3 StreamingBody) so it yields decompressed bytes starting at ``offset``.  Gzip
+    streams can't be seeked, so the first ``offset`` decompressed bytes are read and discarded (resuming costs as
+    much as reading the file up to ``offset`` again).  Uncompressed streams are expected to already start at
+    ``offset`` (ex. a ranged GET).
+    """
+    if not is_gzipped(key):
+        return body
+    stream = gzip.GzipFile(fileobj=body)
+    while offset > 0:
+        skipped = len(stream.read(min(offset, CHUNK_SIZE)))
+        if not skipped:
+            break
+        offset -= skipped
+    return stream
+
+
+class _Buffer(object):
+    """Text buffer over a byte stream which tracks the byte offset of its first character"""
+
+    def __init__(self, stream, offset):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.offset = offset
+        self.eof = False
+
+    def fill(self):
+        """Read another chunk into the buffer, returning False at the end of the stream"""
+        if self.eof:
+            return False
+        chunk = self.stream.read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            self.text += self.decoder.decode(b'', final=True)
+            return False
+        self.text += self.decoder.decode(chunk)
+        return True
+
+    def consume(self, n):
+        self.offset += len(self.text[:n].encode('utf-8'))
+        self.text = self.text[n:]
+
+    def peek(self):
+        """Skip whitespace and return the next character (None at the end of the stream)"""
+        while True:
+            stripped = self.text.lstrip()
+            self.consume(len(self.text) - len(stripped))
+            if self.text:
+                return self.text[0]
+            if not self.fill():
+                return None
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at byte {self.offset}")
+        self.consume(1)
+
+    def decode(self, decoder):
+        """Decode the next JSON value, reading more of the stream until the value is complete"""
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text)
+                # A number at the end of the buffer may continue in the next chunk.
+                if end < len(self.text) or self.eof:
+                    self.consume(end)
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Double the buffer so large values aren't re-parsed once per chunk.
+            size = len(self.text)
+            while len(self.text) < 2 * size and self.fill():
+                pass
+
+
+def _iter_features(buf, decoder):
+    """Yield (feature, offset) for each element of a ``features`` array, stopping after its closing bracket"""
+    while True:
+        char = buf.peek()
+        if char == ']':
+            buf.consume(1)
+            return
+        elif char == ',':
+            buf.consume(1)
+            continue
+        elif char is None:
+            return
+        feature = buf.decode(decoder)
+        yield feature, buf.offset
+
+
+def _iter_json(buf, decoder):
+    """Yield features of a FeatureCollection/ItemCollection as they are read, or the object itself if it has none"""
+    obj = {}
+    has_features = False
+    buf.expect('{')
+    while True:
+        char = buf.peek()
+        if char == '}':
+            buf.consume(1)
+            break
+        elif char == ',':
+            buf.consume(1)
+            continue
+        key = buf.decode(decoder)
+        buf.expect(':')
+        if key == 'features':
+            has_features = True
+            buf.expect('[')
+            yield from _iter_features(buf, decoder)
+        else:
+            obj[key] = buf.decode(decoder)
+
+    if not has_features:
+        yield obj, buf.offset
+
+
+def _iter_ndjson(buf, decoder, raw=False):
+    while True:
+        newline = buf.text.find('\n')
+        if newline == -1:
+            if buf.fill():
+                continue
+            newline = len(buf.text)
+            if not newline:
+                return
+        line = buf.text[:newline].strip()
+        buf.consume(newline + 1 if newline < len(buf.text) else newline)
+        if line:
+            yield line if raw else decoder.decode(line), buf.offset
+
+
+def iter_items(stream, format, offset=0, raw=False):
+    """
+    Iterate over the STAC Items in a (decompressed) bulk file with bounded memory.  Yields (item, offset) where
+    ``offset`` is the byte offset just after the item, which may be used to resume reading in the ``resume_format``
+    of ``format``.  With ``raw``, the lines of NDJSON files are yielded as they are instead of being parsed (items of
+    other formats have to be parsed to find where they end).
+    """
+    buf = _Buffer(stream, offset)
+    decoder = json.JSONDecoder()
+    if format == NDJSON:
+        return _iter_ndjson(buf, decoder, raw)
+    elif format == FEATURES:
+        return _iter_features(buf, decoder)
+    return _iter_json(buf, decoder)
+
+
+def resume_format(format):
+    """Format of a bulk file when reading is resumed from an offset returned by ``iter_items``"""
+    return FEATURES if format == JSON else format
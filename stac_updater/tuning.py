@@ -0,0 +1,166 @@
+"""
+Recommend the settings of each collection's update_collection function (SQS batch size and batching window, memory
+size and reserved concurrency) from the invocation logs indexed by es_log_ingest.  Duration and peak memory are fitted
+against the number of items per invocation, and every candidate setting is priced by the Lambda GB-second and request
+prices.  The cheapest setting which keeps up with the peak arrival rate of the collection's items is recommended.
+"""
+from collections import Counter
+import json
+import math
+import time
+
+# Lambda prices (us-east-1, x86): per GB-second of billed duration, and per request.
+GB_SECOND_PRICE = 0.0000166667
+REQUEST_PRICE = 0.0000002
+# Memory sizes considered (MB), functions get a full vCPU from FULL_CPU_MEMORY.
+MEMORY_SIZES = [128, 256, 512, 768, 1024, 1536, 1769, 2048, 3008]
+FULL_CPU_MEMORY = 1769
+BATCH_SIZES = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+FIFO_MAX_BATCH = 10
+MAX_BATCHING_WINDOW = 300
+# Headroom over the predicted peak memory, and fraction of the function timeout a batch may take.
+MEMORY_HEADROOM = 1.25
+TIMEOUT_FRACTION = 0.5
+# Batch sizes aren't extrapolated beyond this multiple of the largest batch in the logs.
+MAX_EXTRAPOLATION = 4
+# Share of an invocation spent on CPU when the logs don't include the stage timings.
+DEFAULT_CPU_SHARE = 0.5
+
+
+def read_log_file(path):
+    """Log documents exported from ES: a JSON list of documents, a search response, or one document per line"""
+    with open(path) as f:
+        text = f.read()
+    try:
+        docs = json.loads(text)
+    except ValueError:
+        docs = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(docs, dict):
+        docs = docs['hits']['hits']
+    return [x.get('_source', x) for x in docs]
+
+
+def search_logs(es, days=7, max_docs=10000):
+    """Log documents of the last ``days`` days (most recent first)"""
+    from stac_updater.logging import INDEX_PREFIX
+
+    since = int((time.time() - days * 86400) * 1000)
+    resp = es.search(index=INDEX_PREFIX + '*', body={
+        'query': {'range': {'timestamp': {'gte': since}}},
+        'sort': [{'timestamp': {'order': 'desc'}}],
+        'size': max_docs
+    })
+    return [x['_source'] for x in resp['hits']['hits']]
+
+
+def linear_fit(xs, ys):
+    """Least squares fit of ``ys = a + b * xs`` (with non-negative a and b), returns (a, b)"""
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    sxx = sum((x - mx) ** 2 for x in xs)
+    if not sxx:
+        return 0.0, my / mx if mx else 0.0
+    b = max(sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx, 0.0)
+    return max(my - b * mx, 0.0), b
+
+
+def collection_stats(docs):
+    """
+    Model of each collection's invocations, as {collection: stats}.  Durations are split into I/O time and CPU time
+    (AddDuration, scaled to a full vCPU) so they can be predicted at other memory sizes.  Documents without both the
+    LOGS and REPORT fields are ignored.
+    """
+    groups = {}
+    for doc in docs:
+        if all(doc.get(k) for k in ('CollectionName', 'ItemCount', 'Duration', 'MemorySize', 'MaxMemoryUsed')):
+            groups.setdefault(doc['CollectionName'], []).append(doc)
+
+    stats = {}
+    for name, group in groups.items():
+        counts = [doc['ItemCount'] for doc in group]
+        io, cpu = [], []
+        for doc in group:
+            share = min(doc['AddDuration'] / doc['Duration'], 1.0) if 'AddDuration' in doc else DEFAULT_CPU_SHARE
+            io.append((1 - share) * doc['Duration'])
+            cpu.append(share * doc['Duration'] * min(doc['MemorySize'], FULL_CPU_MEMORY) / FULL_CPU_MEMORY)
+        memory = linear_fit(counts, [doc['MaxMemoryUsed'] for doc in group])
+        memory_margin = max(doc['MaxMemoryUsed'] - (memory[0] + memory[1] * doc['ItemCount']) for doc in group)
+
+        timestamps = [doc['timestamp'] for doc in group if 'timestamp' in doc]
+        span = (max(timestamps) - min(timestamps)) / 1000 if timestamps else 0
+        per_minute = Counter()
+        for doc in group:
+            per_minute[doc.get('timestamp', 0) // 60000] += doc['ItemCount']
+
+        stats[name] = {
+            'invocations': len(group),
+            'items': sum(counts),
+            'max_batch': max(counts),
+            'io': linear_fit(counts, io),
+            'cpu': linear_fit(counts, cpu),
+            'memory': (memory[0] + max(memory_margin, 0.0), memory[1]),
+            'memory_size': Counter(doc['MemorySize'] for doc in group).most_common(1)[0][0],
+            'cost_per_item': sum(invocation_cost(doc['Duration'], doc['MemorySize']) for doc in group) / sum(counts),
+            'rate': sum(counts) / max(span, 60),
+            'peak_rate': max(per_minute.values()) / 60,
+        }
+    return stats
+
+
+def invocation_cost(duration, memory_size):
+    """Price of an invocation (duration in ms, memory in MB)"""
+    return math.ceil(duration) / 1000 * memory_size / 1024 * GB_SECOND_PRICE + REQUEST_PRICE
+
+
+def predict(stats, batch_size, memory_size):
+    """Predicted (duration in ms, peak memory in MB) of an invocation"""
+    io = stats['io'][0] + stats['io'][1] * batch_size
+    cpu = stats['cpu'][0] + stats['cpu'][1] * batch_size
+    duration = io + cpu * FULL_CPU_MEMORY / min(memory_size, FULL_CPU_MEMORY)
+    return duration, stats['memory'][0] + stats['memory'][1] * batch_size
+
+
+def recommend(stats, fifo=False, timeout=6, max_concurrency=10, max_window=20, concurrent=None):
+    """
+    Cheapest settings (per item) which keep up with the peak arrival rate, as a dict of batchSize,
+    maximumBatchingWindow, memorySize, concurrency and the predicted duration, throughput and cost.  Only collections
+    which may be updated concurrently (``concurrent``, by default collections updated through a FIFO queue) get a
+    concurrency above 1, others would have concurrent invocations lose each other's links.  When no setting keeps up,
+    the one with the highest throughput is returned.  Returns None if no setting fits in memory and within the
+    timeout.
+    """
+    concurrent = fifo if concurrent is None else concurrent
+    max_batch = min(FIFO_MAX_BATCH if fifo else BATCH_SIZES[-1], stats['max_batch'] * MAX_EXTRAPOLATION)
+    candidates = []
+    for batch_size in [x for x in BATCH_SIZES if x <= max(max_batch, 1)]:
+        # Batches are only worth waiting for if they fill up within the batching window.
+        window = 0 if fifo else min(math.ceil(batch_size / stats['rate']), max_window, MAX_BATCHING_WINDOW)
+        if batch_size > 1 and not fifo and batch_size / stats['rate'] > max_window:
+            continue
+        if batch_size > 10 and not window:
+            # SQS requires a batching window for batches of more than 10 messages.
+            window = 1
+        for memory_size in MEMORY_SIZES:
+            duration, memory = predict(stats, batch_size, memory_size)
+            if memory * MEMORY_HEADROOM > memory_size or duration > timeout * 1000 * TIMEOUT_FRACTION:
+                continue
+            throughput = batch_size / (duration / 1000)
+            candidates.append({
+                'batchSize': batch_size,
+                'maximumBatchingWindow': window,
+                'memorySize': memory_size,
+                'concurrency': max(math.ceil(stats['peak_rate'] / throughput), 1) if concurrent else 1,
+                'duration': duration,
+                'throughput': throughput,
+                'costPerItem': invocation_cost(duration, memory_size) / batch_size
+            })
+
+    if not candidates:
+        return None
+    fast_enough = [x for x in candidates if x['concurrency'] <= max_concurrency
+                   and x['throughput'] * x['concurrency'] >= stats['peak_rate']]
+    if fast_enough:
+        return min(fast_enough, key=lambda x: (x['costPerItem'], x['duration']))
+    best = max(candidates, key=lambda x: (x['throughput'], -x['costPerItem']))
+    best['concurrency'] = min(best['concurrency'], max_concurrency)
+    return best
@@ -1,4 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
 import json
+import os
+import re
+import time
+import warnings
+
+# JSON library used to parse and serialize STAC Items and catalogs: json (default), orjson, ujson or rapidjson.
+JSON_CODEC = os.getenv('JSON_CODEC', 'json')
+
+
+def _codec(name):
+    """(loads, dumps) of a JSON library, falling back to the standard library if it isn't installed"""
+    try:
+        if name == 'orjson':
+            import orjson
+            return orjson.loads, lambda obj: orjson.dumps(obj).decode('utf-8')
+        elif name == 'ujson':
+            import ujson
+            return ujson.loads, lambda obj: ujson.dumps(obj, escape_forward_slashes=False)
+        elif name == 'rapidjson':
+            import rapidjson
+            return rapidjson.loads, rapidjson.dumps
+    except ImportError:
+        warnings.warn(f"JSON_CODEC {name} is not installed, using json.")
+    return json.loads, json.dumps
+
+
+loads, dumps = _codec(JSON_CODEC)
+
+# Fields read from serialized STAC Items without parsing them.
+COLLECTION = re.compile(r'"collection"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def _field(pattern, body):
+    """Value of a field which appears exactly once in a serialized STAC Item (None if missing or ambiguous)"""
+    values = set(pattern.findall(body))
+    return values.pop() if len(values) == 1 else None
+
+
+def item_collection(body):
+    """Collection of a serialized STAC Item, the item is only parsed if the field can't be found unambiguously"""
+    value = _field(COLLECTION, body)
+    if value is None:
+        item = loads(body)
+        return item['properties']['collection'] if 'collection' in item.get('properties', {}) else item['collection']
+    return json.loads('"%s"' % value) if '\\' in value else value
+
+
+def sat_stac_pattern(pattern):
+    """Convert a `--path`/`--filename` pattern (ex. `{landsat:path}/{landsat:row}`) to a sat-stac template"""
+    return '$' + '/$'.join(pattern.split('/'))
+
 
 def stac_to_sns(stac_item):
     """Convert a STAC item to SNS message (with attributes)"""
@@ -7,23 +59,24 @@ def stac_to_sns(stac_item):
         collection = stac_item['collection']
     except KeyError:
         collection = stac_item['properties']['collection']
+    bbox = stac_item['bbox']
 
     attributes = {
         'bbox.xmin': {
             "DataType": "Number",
-            "StringValue": str(stac_item['bbox'][0])
+            "StringValue": str(bbox[0])
         },
         'bbox.ymin': {
             "DataType": "Number",
-            "StringValue": str(stac_item['bbox'][1])
+            "StringValue": str(bbox[1])
         },
         'bbox.xmax': {
             "DataType": "Number",
-            "StringValue": str(stac_item['bbox'][2])
+            "StringValue": str(bbox[2])
         },
         'bbox.ymax': {
             "DataType": "Number",
-            "StringValue": str(stac_item['bbox'][3])
+            "StringValue": str(bbox[3])
         },
         'collection': {
             "DataType": "String",
@@ -32,7 +85,103 @@ def stac_to_sns(stac_item):
     }
 
     return {
-        "Message": json.dumps(stac_item),
+        "Message": dumps(stac_item),
         "MessageAttributes": attributes
     }
 
+
+# PublishBatch and SendMessageBatch requests carry at most 10 entries, and 256 KiB of messages (with attributes).
+MAX_BATCH_BYTES = 256 * 1024
+
+
+def _publish_batch(client, topic_arn, entries):
+    """Publish up to 10 entries with a single PublishBatch request, returning the entries which failed"""
+    try:
+        resp = client.publish_batch(TopicArn=topic_arn, PublishBatchRequestEntries=entries)
+    except Exception as e:
+        print(f"PublishBatch request failed: {e}")
+        return [(entry, False) for entry in entries]
+    by_id = {entry['Id']: entry for entry in entries}
+    return [(by_id[x['Id']], x.get('SenderFault', False)) for x in resp.get('Failed', [])]
+
+
+def _send_message_batch(client, queue_url, entries):
+    """Send up to 10 entries with a single SendMessageBatch request, returning the entries which failed"""
+    try:
+        resp = client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+    except Exception as e:
+        print(f"SendMessageBatch request failed: {e}")
+        return [(entry, False) for entry in entries]
+    by_id = {entry['Id']: entry for entry in entries}
+    return [(by_id[x['Id']], x.get('SenderFault', False)) for x in resp.get('Failed', [])]
+
+
+def message_size(message):
+    """Size (bytes) of a SNS or SQS message, counting its body and attributes"""
+    size = len((message.get('Message') or message.get('MessageBody', '')).encode('utf-8'))
+    for name, attribute in message.get('MessageAttributes', {}).items():
+        size += len(name.encode('utf-8')) + len(attribute['DataType'].encode('utf-8')) + \
+            len(attribute.get('StringValue', '').encode('utf-8'))
+    return size
+
+
+def _pack(entries, batch_size, max_bytes=MAX_BATCH_BYTES):
+    """Split entries into batches of at most ``batch_size`` entries and ``max_bytes`` bytes of messages"""
+    batches = []
+    size = 0
+    for entry in entries:
+        entry_size = message_size(entry)
+        if not batches or len(batches[-1]) >= batch_size or size + entry_size > max_bytes:
+            batches.append([])
+            size = 0
+        batches[-1].append(entry)
+        size += entry_size
+    return batches
+
+
+def _send_batches(send_batch, messages, batch_size, max_workers, max_retries):
+    """
+    Send messages in batches with ``send_batch``, sending several batches concurrently.  Batches are packed within the
+    entry and size limits of a batch request.  Failed entries are retried (without resending the entries which
+    succeeded) unless the failure was the sender's fault.  Returns the messages which could not be sent.
+    """
+    pending = [dict(message, Id=str(i)) for i, message in enumerate(messages)]
+    failed = []
+
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        if attempt > 0:
+            time.sleep(0.1 * 2 ** attempt)
+
+        batches = _pack(pending, batch_size)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+            results = executor.map(send_batch, batches)
+
+        pending = []
+        for entry, sender_fault in [x for result in results for x in result]:
+            if sender_fault:
+                failed.append(entry)
+            else:
+                pending.append(entry)
+
+    return [messages[int(entry['Id'])] for entry in failed + pending]
+
+
+def publish_messages(client, topic_arn, messages, batch_size=10, max_workers=4, max_retries=3):
+    """
+    Publish SNS messages (see stac_to_sns) with PublishBatch, sending several batches concurrently.  Failed entries are
+    retried (without resending the entries which succeeded) unless the failure was the sender's fault.  Returns the
+    messages which could not be published.
+    """
+    return _send_batches(lambda entries: _publish_batch(client, topic_arn, entries), messages,
+                         batch_size, max_workers, max_retries)
+
+
+def send_messages(client, queue_url, messages, batch_size=10, max_workers=4, max_retries=3):
+    """
+    Send SQS messages (``MessageBody`` and, for FIFO queues, ``MessageGroupId``) with SendMessageBatch, retrying like
+    publish_messages.  Returns the messages which could not be sent.
+    """
+    return _send_batches(lambda entries: _send_message_batch(client, queue_url, entries), messages,
+                         batch_size, max_workers, max_retries)